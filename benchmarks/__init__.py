@@ -0,0 +1 @@
+"""Benchmarks of the gathering application, run e.g. python -m benchmarks.run"""
@@ -0,0 +1,73 @@
+"""Compares sorting by locale.strxfrm on every call with the collation index.
+
+Uses the Czech collation when the cs_CZ.UTF-8 locale is installed.
+
+Usage: python -m benchmarks.bench_collation [--units N] [--repeat N]
+"""
+import argparse
+import json
+import locale
+import time
+from typing import Any, Callable, Dict
+
+from benchmarks import generator
+from shromazdeni import business
+from shromazdeni import utils
+from shromazdeni.reports import utils as reports_utils
+
+
+def best_of(func: Callable[[], Any], repeat: int) -> float:
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        times.append(time.perf_counter() - start)
+    return min(times)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--units", type=int, default=5000)
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+    try:
+        collation = locale.setlocale(locale.LC_COLLATE, "cs_CZ.UTF-8")
+    except locale.Error:
+        collation = locale.setlocale(locale.LC_COLLATE, "")
+    json_flats = generator.generate_building(generator.BuildingSpec(units=args.units))
+    model = business.Building(utils.from_json_to_flats(json_flats))
+    persons = {person for flat in model.flats for person in flat.persons}
+
+    owners = [reports_utils.owners_display_name(flat) for flat in model.flats]
+
+    def report_order_strxfrm() -> Any:
+        return sorted(owners, key=locale.strxfrm)
+
+    def report_order_index() -> Any:
+        return sorted(owners, key=reports_utils.collation_index(model).key)
+
+    def persons_strxfrm() -> Any:
+        return sorted(persons, key=locale.strxfrm)
+
+    def persons_index() -> Any:
+        return reports_utils.collation_index(model).sorted(persons)
+
+    start = time.perf_counter()
+    reports_utils.collation_index(model)
+    results: Dict[str, Any] = {
+        "collation": collation,
+        "units": args.units,
+        "index_build_s": time.perf_counter() - start,
+    }
+    for name, func in [
+        ("report_order_strxfrm_s", report_order_strxfrm),
+        ("report_order_index_s", report_order_index),
+        ("persons_strxfrm_s", persons_strxfrm),
+        ("persons_index_s", persons_index),
+    ]:
+        results[name] = best_of(func, args.repeat)
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+    main()
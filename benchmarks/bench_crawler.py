@@ -0,0 +1,126 @@
+"""Compares the selector based owner parser with the single pass one.
+
+Pages are saved katastr unit pages, html files or directories searched for
+them, e.g. the --cache-dir of the crawler. Without pages a generated page
+with --owners rows is parsed. Needs scrapy.
+
+Usage: python -m benchmarks.bench_crawler [--owners N] [--repeat N] [PAGE ...]
+"""
+import argparse
+import json
+import os
+import time
+from typing import Any, Dict, List
+
+from scrapy.http import HtmlResponse
+
+from shromazdeni.tools import crawler
+
+
+def parse_owners_selectors(response: Any) -> List[Dict]:
+    """The previous parser, evaluates selectors on every row."""
+    rows = response.css("table.vlastnici tr")
+    owners: List[Dict[str, str]] = []
+    person_index = 0
+
+    for row in rows[1:]:
+        if row.css(".partnerSJM"):
+            person = row.xpath(".//i/text()").get()
+            if person_index == 0:
+                owners[-1]["person1"] = person
+            else:
+                owners[-1]["person2"] = person
+            person_index += 1
+        else:
+            person_index = 0
+            name = row.xpath("td[1]/text()").get()
+            if not name:
+                break
+            fraction_el = row.css(".right").xpath("text()").get()
+            owners.append({"name": name, "fraction": fraction_el or "1"})
+    return owners
+
+
+def generate_page(owners: int) -> bytes:
+    """Every third owner is SJM with two partner rows."""
+    fraction = f'<td class="right">1/{owners}</td>'
+    rows = ['<tr><th>Vlastnické právo</th><th class="right">Podíl</th></tr>']
+    for i in range(owners):
+        if i % 3:
+            rows.append(f"<tr><td>Osoba {i}, Ulice {i}</td>{fraction}</tr>")
+        else:
+            rows.append(f"<tr><td>SJM Osoba {i}</td>{fraction}</tr>")
+            for partner in ("A", "B"):
+                rows.append(
+                    f'<tr><td class="partnerSJM"><i>Partner {partner}{i}</i></td></tr>'
+                )
+    table = "\n".join(rows)
+    html = f'<html><body><table class="vlastnici">{table}</table></body></html>'
+    return html.encode()
+
+
+def find_pages(paths: List[str]) -> List[bytes]:
+    filenames: List[str] = []
+    for path in paths:
+        if os.path.isdir(path):
+            for dirpath, _dirnames, names in os.walk(path):
+                # Scrapy stores cached bodies as response_body.
+                filenames.extend(
+                    os.path.join(dirpath, name)
+                    for name in names
+                    if name == "response_body" or name.endswith(".html")
+                )
+        else:
+            filenames.append(path)
+    pages = []
+    for filename in sorted(filenames):
+        with open(filename, "rb") as fin:
+            body = fin.read()
+        if b"vlastnici" in body:
+            pages.append(body)
+    return pages
+
+
+def best_of(func: Any, responses: List[HtmlResponse], repeat: int) -> float:
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        for response in responses:
+            func(response)
+        times.append(time.perf_counter() - start)
+    return min(times)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("pages", nargs="*")
+    parser.add_argument("--owners", type=int, default=200)
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+    bodies = find_pages(args.pages) if args.pages else [generate_page(args.owners)]
+    responses = [
+        HtmlResponse("https://nahlizenidokn.cuzk.cz/Jednotka.aspx", body=body)
+        for body in bodies
+    ]
+    for response in responses:
+        # Also parses the html, only the owners table is measured.
+        if crawler.parse_owners(response) != parse_owners_selectors(response):
+            raise SystemExit(f"different owners: {response}")
+    selectors = best_of(parse_owners_selectors, responses, args.repeat)
+    single_pass = best_of(crawler.parse_owners, responses, args.repeat)
+    print(
+        json.dumps(
+            {
+                "pages": len(responses),
+                "owners": sum(len(crawler.parse_owners(r)) for r in responses),
+                "selectors_ms": selectors * 1000,
+                "single_pass_ms": single_pass * 1000,
+                "speedup": selectors / single_pass,
+            },
+            indent=2,
+        )
+    )
+
+
+if __name__ == "__main__":
+    main()
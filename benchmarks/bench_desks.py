@@ -0,0 +1,69 @@
+"""Measures round trip latency of desk commands through the coordinator.
+
+Usage: python -m benchmarks.bench_desks [--units N] [--desks N] [--commands N]
+"""
+import argparse
+import asyncio
+import json
+import socket
+import threading
+import time
+from typing import List
+
+from benchmarks import generator
+from shromazdeni import business
+from shromazdeni import desks
+from shromazdeni import utils
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("localhost", 0))
+        port: int = sock.getsockname()[1]
+        return port
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--units", type=int, default=2000)
+    parser.add_argument("--desks", type=int, default=6)
+    parser.add_argument("--commands", type=int, default=3000)
+    args = parser.parse_args()
+    json_flats = generator.generate_building(generator.BuildingSpec(units=args.units))
+    model = business.Building(utils.from_json_to_flats(json_flats))
+    address = ("localhost", free_port())
+    loop = asyncio.new_event_loop()
+    loop.run_until_complete(desks.Coordinator(model).start(address))
+    threading.Thread(target=loop.run_forever, daemon=True).start()
+
+    clients = [
+        desks.RemoteBuilding(utils.from_json_to_flats(json_flats), address)
+        for _ in range(args.desks)
+    ]
+    flat_names = [flat.name for flat in model.flats]
+    latencies: List[float] = []
+    for i in range(args.commands):
+        desk = clients[i % len(clients)]
+        person = f"Osoba {i}"
+        start = time.perf_counter()
+        desk.add_person(person)
+        desk.represent_flat(flat_names[i % len(flat_names)], person)
+        desk.remove_person(person)
+        latencies.append((time.perf_counter() - start) / 3)
+    latencies.sort()
+    print(
+        json.dumps(
+            {
+                "desks": args.desks,
+                "commands": 3 * args.commands,
+                "p50_ms": latencies[len(latencies) // 2] * 1000,
+                "p99_ms": latencies[len(latencies) * 99 // 100] * 1000,
+                "max_ms": latencies[-1] * 1000,
+            },
+            indent=2,
+        )
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,55 @@
+"""Compares latency of logging a command with the synchronous and group commit logger.
+
+Usage: python -m benchmarks.bench_logger [--rows N]
+"""
+import argparse
+import os
+import tempfile
+import time
+from typing import Callable, Dict
+
+from shromazdeni import __main__
+
+
+def bench_logger(
+    make_logger: Callable[..., __main__.CommandLogger], rows: int
+) -> Dict[str, float]:
+    with tempfile.TemporaryDirectory() as tmpdir:
+        logfile = __main__.CommandLogger.create_logfile(
+            os.path.join(tmpdir, "bench.log")
+        )
+        logger = make_logger(logfile)
+        start = time.perf_counter()
+        for i in range(rows):
+            logger.log("represent_flat", (str(i), "Petr Novák"))
+        logged = time.perf_counter()
+        logger.close()
+        closed = time.perf_counter()
+        logfile.close()
+    return {
+        "log_us": (logged - start) / rows * 1e6,
+        "total_s": closed - start,
+    }
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--rows", type=int, default=10000)
+    args = parser.parse_args()
+    loggers: Dict[str, Callable[..., __main__.CommandLogger]] = {
+        "sync": __main__.CommandLogger,
+        "group_commit": __main__.DurableCommandLogger,
+        "group_commit_fsync_each": lambda fout: __main__.DurableCommandLogger(
+            fout, fsync_rows=1
+        ),
+    }
+    for name, make_logger in loggers.items():
+        result = bench_logger(make_logger, args.rows)
+        print(
+            f"{name:24s} {result['log_us']:8.2f} us/log  "
+            f"{result['total_s']:6.3f} s total"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,89 @@
+"""Measures memory and desk latency of one service hosting many gatherings.
+
+Usage: python -m benchmarks.bench_service [--gatherings N] [--units N]
+"""
+import argparse
+import asyncio
+import json
+import os
+import tempfile
+import threading
+import time
+import tracemalloc
+from typing import List
+
+from benchmarks import generator
+from benchmarks.bench_desks import free_port
+from shromazdeni import desks
+from shromazdeni import service
+from shromazdeni import utils
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--gatherings", type=int, default=100)
+    parser.add_argument("--units", type=int, default=300)
+    parser.add_argument("--commands", type=int, default=1000)
+    args = parser.parse_args()
+    with tempfile.TemporaryDirectory() as tmpdir:
+        config = {}
+        for i in range(args.gatherings):
+            spec = generator.BuildingSpec(units=args.units, seed=i)
+            filename = os.path.join(tmpdir, f"building{i}.json")
+            with open(filename, "w") as fout:
+                json.dump(generator.generate_building(spec), fout)
+            config[f"g{i}"] = {"flats": filename}
+        config_filename = os.path.join(tmpdir, "config.json")
+        with open(config_filename, "w") as fout:
+            json.dump(config, fout)
+
+        tracemalloc.start()
+        start = time.perf_counter()
+        hosted = service.GatheringService.from_config(config_filename)
+        load_time = time.perf_counter() - start
+        memory, _peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+
+        address = ("localhost", free_port())
+        loop = asyncio.new_event_loop()
+        loop.run_until_complete(hosted.start(address))
+        threading.Thread(target=loop.run_forever, daemon=True).start()
+
+        names = sorted(hosted.gatherings)[:10]
+        clients = []
+        for name in names:
+            with open(config[name]["flats"], "rb") as fin:
+                flats = utils.load_flats(fin)
+            clients.append(desks.RemoteBuilding(flats, address, name))
+        latencies: List[float] = []
+        for i in range(args.commands):
+            desk = clients[i % len(clients)]
+            flat_name = desk.flats[i % len(desk.flats)].name
+            person = f"Osoba {i}"
+            start = time.perf_counter()
+            desk.add_person(person)
+            desk.represent_flat(flat_name, person)
+            desk.remove_person(person)
+            latencies.append((time.perf_counter() - start) / 3)
+        latencies.sort()
+        for desk in clients:
+            desk.close()
+        hosted.close()
+    print(
+        json.dumps(
+            {
+                "gatherings": args.gatherings,
+                "units": args.units,
+                "load_s": load_time,
+                "memory_mb": memory / 2**20,
+                "memory_per_gathering_kb": memory / args.gatherings / 2**10,
+                "p50_ms": latencies[len(latencies) // 2] * 1000,
+                "p99_ms": latencies[len(latencies) * 99 // 100] * 1000,
+            },
+            indent=2,
+        )
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,42 @@
+"""Measures loading of flats from json and from the converted flats cache.
+
+Usage: python -m benchmarks.bench_startup [--units N]
+"""
+import argparse
+import json
+import os
+import tempfile
+import time
+
+from benchmarks import generator
+from shromazdeni import business
+from shromazdeni import utils
+
+
+def write_synthetic_building(filename: str, units: int) -> None:
+    flats = generator.generate_building(generator.BuildingSpec(units=units))
+    with open(filename, "w") as fout:
+        json.dump(flats, fout)
+
+
+def time_load(filename: str, use_cache: bool) -> float:
+    start = time.perf_counter()
+    with open(filename, "rb") as fin:
+        business.Building(utils.load_flats(fin, use_cache))
+    return time.perf_counter() - start
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--units", type=int, default=100000)
+    args = parser.parse_args()
+    with tempfile.TemporaryDirectory() as tmpdir:
+        filename = os.path.join(tmpdir, "flats.json")
+        write_synthetic_building(filename, args.units)
+        print(f"json:         {time_load(filename, use_cache=False):.3f} s")
+        print(f"cache create: {time_load(filename, use_cache=True):.3f} s")
+        print(f"cache hit:    {time_load(filename, use_cache=True):.3f} s")
+
+
+if __name__ == "__main__":
+    main()
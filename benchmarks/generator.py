@@ -0,0 +1,104 @@
+"""Deterministic generator of katastr-shaped buildings.
+
+Usage: python -m benchmarks.generator --units 5000 -o flats.json
+"""
+import argparse
+import json
+import random
+import sys
+from typing import Dict, List, NamedTuple
+
+SURNAMES = ["Novák", "Svoboda", "Novotný", "Dvořák", "Černý", "Procházka", "Kučera"]
+FIRST_NAMES = ["Jan", "Petr", "Jana", "Marie", "Josef", "Eva", "Tomáš", "Lucie"]
+STREETS = ["Pařížská", "Národní", "Vodičkova", "Žitná", "Karlova"]
+
+
+class BuildingSpec(NamedTuple):
+    units: int = 1000
+    # Part of units owned by married couples (SJM).
+    sjm_ratio: float = 0.3
+    # Garage halls shared by many co-owners, each counts as one unit.
+    garage_units: int = 2
+    owners_per_garage: int = 100
+    # Flat fractions are drawn over this denominator multiplied by units.
+    denominator: int = 1000
+    building_number: int = 777
+    seed: int = 0
+
+
+def _person(rng: random.Random, i: int) -> str:
+    surname = rng.choice(SURNAMES)
+    return f"{surname}{i} {rng.choice(FIRST_NAMES)}"
+
+
+def _address(rng: random.Random, i: int) -> str:
+    return f"{rng.choice(STREETS)} {i}, Praha 1"
+
+
+def generate_building(spec: BuildingSpec = BuildingSpec()) -> List[Dict]:
+    """Returns flats in the same json form as the crawler output."""
+    rng = random.Random(spec.seed)
+    denominator = spec.denominator * spec.units
+    flats: List[Dict] = []
+    owner_names = []
+    n_flats = spec.units - spec.garage_units
+    for i in range(1, n_flats + 1):
+        if rng.random() < spec.sjm_ratio:
+            name = (
+                f"SJM {_person(rng, i)} a {_person(rng, i)}, "
+                f"{_address(rng, i)}"
+            )
+        else:
+            name = f"{_person(rng, i)}, {_address(rng, i)}"
+        owner_names.append(name)
+        flats.append(
+            {
+                "name": f"{spec.building_number}/{i}",
+                "fraction": f"{rng.randint(1, 2 * spec.denominator)}/{denominator}",
+                "owners": [{"name": name, "fraction": "1"}],
+            }
+        )
+    for i in range(n_flats + 1, spec.units + 1):
+        # Garage spots are mostly owned by people owning a flat.
+        n_owners = max(1, min(spec.owners_per_garage, len(owner_names)))
+        owners = rng.sample(owner_names, n_owners) if owner_names else ["Firma s.r.o."]
+        flats.append(
+            {
+                "name": f"{spec.building_number}/{i}",
+                "fraction": f"{rng.randint(1, 2 * spec.denominator)}/{denominator}",
+                "owners": [
+                    {"name": name, "fraction": f"1/{len(owners)}"} for name in owners
+                ],
+            }
+        )
+    return flats
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__)
+    defaults = BuildingSpec()
+    parser.add_argument("--units", type=int, default=defaults.units)
+    parser.add_argument("--sjm-ratio", type=float, default=defaults.sjm_ratio)
+    parser.add_argument("--garage-units", type=int, default=defaults.garage_units)
+    parser.add_argument(
+        "--owners-per-garage", type=int, default=defaults.owners_per_garage
+    )
+    parser.add_argument("--denominator", type=int, default=defaults.denominator)
+    parser.add_argument("--seed", type=int, default=defaults.seed)
+    parser.add_argument(
+        "-o", "--output", type=argparse.FileType("w"), default=sys.stdout
+    )
+    args = parser.parse_args()
+    spec = BuildingSpec(
+        units=args.units,
+        sjm_ratio=args.sjm_ratio,
+        garage_units=args.garage_units,
+        owners_per_garage=args.owners_per_garage,
+        denominator=args.denominator,
+        seed=args.seed,
+    )
+    json.dump(generate_building(spec), args.output, ensure_ascii=False)
+
+
+if __name__ == "__main__":
+    main()
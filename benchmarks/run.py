@@ -0,0 +1,199 @@
+"""Times the main operations on a synthetic building and prints results as JSON.
+
+Usage: python -m benchmarks.run --units 5000 -o results.json
+"""
+import argparse
+import csv
+import io
+import json
+import os
+import platform
+import sys
+import tempfile
+import time
+from typing import Any, Callable, Dict, List, Optional
+from unittest import mock
+
+from benchmarks import generator
+from shromazdeni import __main__
+from shromazdeni import batch
+from shromazdeni import business
+from shromazdeni import reports
+from shromazdeni import utils
+
+Benchmark = Callable[[], Callable[[], Any]]
+
+
+def measure(prepare: Benchmark, repeat: int) -> Dict[str, float]:
+    """Runs the function returned by prepare repeat times, prepare isn't timed."""
+    times = []
+    for _ in range(repeat):
+        func = prepare()
+        start = time.perf_counter()
+        func()
+        times.append(time.perf_counter() - start)
+    return {
+        "best_s": min(times),
+        "mean_s": sum(times) / len(times),
+        "repeat": repeat,
+    }
+
+
+def populated_building(
+    json_flats: List[Dict], logger: Optional[business.CommandLogger] = None
+) -> business.Building:
+    """Returns a building where every other flat is represented by its owner."""
+    model = business.Building(utils.from_json_to_flats(json_flats))
+    if logger:
+        model.register_logger(logger)
+    for flat in model.flats[::2]:
+        person = min(flat.persons, default="Firma s.r.o.")
+        if not model.person_exists(person):
+            model.add_person(person)
+        model.represent_flat(flat.name, person)
+    return model
+
+
+def run_session(model: business.Building, commands: List[str]) -> None:
+    cmd = __main__.AppCmd(model, stdout=io.StringIO())
+    with mock.patch.object(__main__, "choice_from", return_value=1), mock.patch.object(
+        __main__, "confirm", return_value=True
+    ):
+        for command in commands:
+            cmd.onecmd(command)
+            cmd.set_prompt()
+
+
+def benchmarks(json_flats: List[Dict], tmpdir: str) -> Dict[str, Benchmark]:
+    flats = utils.from_json_to_flats(json_flats)
+    model = populated_building(json_flats)
+    person = next(iter(model.get_person_names("")))
+    garage = max(model.flats, key=lambda flat: len(flat.persons))
+    garage_owner = min(garage.persons)
+    log = io.StringIO()
+    log.write("date,operation,*args\n")
+    populated_building(json_flats, __main__.CommandLogger(log))
+    unrepresented = [flat.name for flat in model.flats[1::2]][:200]
+    session = [f"add {name}" for name in unrepresented]
+    session += [f"remove {name}" for name in unrepresented]
+    presence_filename = os.path.join(tmpdir, "presence.html")
+    batch_script = io.StringIO()
+    csv.writer(batch_script).writerows(
+        ["add", min(flat.persons, default="Firma s.r.o."), flat.name]
+        for flat in flats[:2000]
+    )
+
+    def load() -> Callable[[], Any]:
+        return lambda: utils.from_json_to_flats(json_flats)
+
+    def building() -> Callable[[], Any]:
+        return lambda: business.Building(flats)
+
+    def percent_represented() -> Callable[[], Any]:
+        return lambda: [model.percent_represented for _ in range(1000)]
+
+    def representative_flats() -> Callable[[], Any]:
+        return lambda: [model.get_representative_flats(person) for _ in range(1000)]
+
+    def other_representatives() -> Callable[[], Any]:
+        return lambda: [
+            model.get_other_representatives(garage_owner) for _ in range(1000)
+        ]
+
+    def app_session() -> Callable[[], Any]:
+        session_model = populated_building(json_flats)
+        return lambda: run_session(session_model, session)
+
+    def replay() -> Callable[[], Any]:
+        replay_model = business.Building(utils.from_json_to_flats(json_flats))
+        log.seek(0)
+        return lambda: __main__.CommandLogger.parse_logfile(log, replay_model)
+
+    def batch_script_ops() -> Callable[[], Any]:
+        batch_model = business.Building(utils.from_json_to_flats(json_flats))
+        batch_model.register_logger(__main__.CommandLogger(io.StringIO()))
+        script = io.StringIO(batch_script.getvalue())
+        return lambda: batch.run_batch(batch_model, script)
+
+    def presence() -> Callable[[], Any]:
+        presence_model = populated_building(json_flats)
+        return lambda: reports.write_presence(presence_model, presence_filename)
+
+    def signatures(jobs: int) -> Benchmark:
+        def prepare() -> Callable[[], Any]:
+            signatures_model = business.Building(utils.from_json_to_flats(json_flats))
+            return lambda: reports.write_signatures(
+                signatures_model, presence_filename, jobs=jobs
+            )
+
+        return prepare
+
+    def presence_after_change() -> Callable[[], Any]:
+        presence_model = populated_building(json_flats)
+        reports.write_presence(presence_model, presence_filename)
+        flat = presence_model.flats[1]
+        presence_model.add_person("Nová Osoba")
+        presence_model.represent_flat(flat.name, "Nová Osoba")
+        return lambda: reports.write_presence(presence_model, presence_filename)
+
+    return {
+        "from_json_to_flats": load,
+        "building_construction": building,
+        "percent_represented_x1000": percent_represented,
+        "get_representative_flats_x1000": representative_flats,
+        "get_other_representatives_x1000": other_representatives,
+        "app_session_400_commands": app_session,
+        "parse_logfile_replay": replay,
+        "batch_2000_ops": batch_script_ops,
+        "write_presence": presence,
+        "write_presence_after_change": presence_after_change,
+        "write_signatures": signatures(1),
+        "write_signatures_parallel": signatures(os.cpu_count() or 1),
+    }
+
+
+def main(argv: List[str]) -> None:
+    parser = argparse.ArgumentParser(description=__doc__)
+    defaults = generator.BuildingSpec()
+    parser.add_argument("--units", type=int, default=defaults.units)
+    parser.add_argument("--sjm-ratio", type=float, default=defaults.sjm_ratio)
+    parser.add_argument("--garage-units", type=int, default=defaults.garage_units)
+    parser.add_argument(
+        "--owners-per-garage", type=int, default=defaults.owners_per_garage
+    )
+    parser.add_argument("--denominator", type=int, default=defaults.denominator)
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument(
+        "-k", dest="only", help="run only benchmarks containing the string"
+    )
+    parser.add_argument(
+        "-o", "--output", type=argparse.FileType("w"), default=sys.stdout
+    )
+    args = parser.parse_args(argv)
+    spec = generator.BuildingSpec(
+        units=args.units,
+        sjm_ratio=args.sjm_ratio,
+        garage_units=args.garage_units,
+        owners_per_garage=args.owners_per_garage,
+        denominator=args.denominator,
+    )
+    json_flats = generator.generate_building(spec)
+    results = {}
+    with tempfile.TemporaryDirectory() as tmpdir:
+        for name, prepare in benchmarks(json_flats, tmpdir).items():
+            if args.only and args.only not in name:
+                continue
+            results[name] = measure(prepare, args.repeat)
+    output = {
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "spec": spec._asdict(),
+        "name_caches": utils.name_cache_stats(),
+        "results": results,
+    }
+    json.dump(output, args.output, indent=2)
+    args.output.write("\n")
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
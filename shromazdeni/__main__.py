@@ -1,25 +1,35 @@
 import argparse
 import cmd
-import csv
-import json
 import locale
-import os
-import pathlib
-from datetime import datetime
-from typing import IO, List, Optional, Set, TextIO, Tuple, Union
+import signal
+import sys
+import time
+from types import FrameType
+from typing import IO, List, Optional, Set
 
+from shromazdeni import batch
 from shromazdeni import business
+from shromazdeni.commandlog import (
+    CommandLogger,
+    DurableCommandLogger,
+    open_or_create_logfile,
+    Snapshots,
+    SNAPSHOT_EVERY,
+)
+from shromazdeni import dashboard
+from shromazdeni import desks
 from shromazdeni import reports
+from shromazdeni import stats
 from shromazdeni import utils
 
 
 def setup_readline_if_available() -> None:
-    # Slash is used as part of flat names.
+    # Slash and dash are used as part of flat names.
     # We don't want to split the names so we can have simple auto completers.
     try:
         import readline
 
-        delims = readline.get_completer_delims().replace("/", "")
+        delims = readline.get_completer_delims().replace("/", "").replace("-", "")
         readline.set_completer_delims(delims)
     except ImportError:
         pass
@@ -47,42 +57,6 @@ def confirm(question: str) -> bool:
     return input(f"\n{question} [yN]> ").lower() == "y"
 
 
-class CommandLogger:
-    def __init__(self, logfile: IO[str]):
-        self._logfile = logfile
-        self._writer = csv.writer(logfile)
-
-    @staticmethod
-    def default_logname(flats_filename: str) -> str:
-        now = datetime.now().strftime("%Y%m%d")
-        filename, _ext = os.path.splitext(flats_filename)
-        filename += f".{now}.log"
-        return filename
-
-    @staticmethod
-    def parse_logfile(logfile: IO[str], model: business.Building) -> None:
-        reader = csv.reader(logfile)
-        next(reader)
-        for row in reader:
-            func = row[1]
-            getattr(model, func)(*row[2:])
-
-    @staticmethod
-    def create_logfile(filename: Union[str, pathlib.Path]) -> TextIO:
-        fout = open(filename, "w")
-        writer = csv.writer(fout)
-        writer.writerow(["date", "operation", "*args"])
-        return fout
-
-    def log(self, func_name: str, args: Tuple) -> None:
-        assert all(isinstance(arg, str) for arg in args)
-        now = datetime.now().strftime("%H:%M")
-        row = [now, func_name]
-        row += args
-        self._writer.writerow(row)
-        self._logfile.flush()
-
-
 class AppCmd(cmd.Cmd):
     def __init__(
         self,
@@ -90,12 +64,42 @@ class AppCmd(cmd.Cmd):
         completekey: str = "tab",
         stdin: IO[str] = None,
         stdout: IO[str] = None,
+        latency_stats: Optional[stats.LatencyStats] = None,
     ):
         self.pm_index = 1
         self.model = model
+        self.latency_stats = latency_stats
+        self._command_start = 0.0
         self.set_prompt()
         super().__init__(completekey=completekey, stdin=stdin, stdout=stdout)
 
+    def precmd(self, line: str) -> str:
+        if self.latency_stats is not None:
+            self._command_start = time.perf_counter()
+        # Other registration desks could have changed the building.
+        self.model.sync()
+        return line
+
+    def onecmd(self, line: str) -> bool:
+        try:
+            with self.model.exclusive():
+                return super().onecmd(line)
+        except business.ConflictError as error:
+            self.stdout.write(f"{error}\n")
+            self.set_prompt()
+            return False
+
+    def postcmd(self, stop: bool, line: str) -> bool:
+        if self.latency_stats is not None:
+            elapsed = time.perf_counter() - self._command_start
+            command = self.parseline(line)[0] or "<empty>"
+            if not hasattr(self, "do_" + command):
+                command = "<unknown>"
+            self.latency_stats.record("command", command, elapsed)
+        self.model.sync()
+        self.set_prompt()
+        return stop
+
     def set_prompt(self) -> None:
         percent = self.model.percent_represented
         can_start = "Y" if percent > 50 else "N"
@@ -119,7 +123,7 @@ class AppCmd(cmd.Cmd):
             self.columnize([flat.nice_name for flat in self.model.flats])
 
     def complete_flat(self, text: str, line: str, beginx: int, endx: int) -> List[str]:
-        return [flat.name for flat in self.model.flats if flat.name.startswith(text)]
+        return self.model.get_flat_names(text)
 
     def _write_flat_owners(self, flat: business.Flat) -> None:
         self.stdout.write(f"{flat.name} owners:\n")
@@ -165,8 +169,13 @@ class AppCmd(cmd.Cmd):
             return
         represented_persons = set()
         # Assign a representative
+        if self.model.person_exists(name):
+            for fname in flats:
+                self.model.represent_flat(fname, name)
+        else:
+            # One change, a conflict on a desk doesn't leave the person behind.
+            self.model.add_representative(name, flats)
         for fname in flats:
-            self.model.represent_flat(fname, name)
             represented_persons.update(self.model.get_flat(fname).persons)
         # Check if the added person doesn't have other shares in the building.
         # e.g. another flat or a share on garage hall.
@@ -178,17 +187,14 @@ class AppCmd(cmd.Cmd):
                 represented_persons.update(self.model.get_flat(other_flat).persons)
         # Write what all represented persons also own.
         # that's important for garage hall.
-        hints = []
-        for flat in self.model.flats:
-            if not flat.represented and represented_persons & flat.persons:
-                hints.append(flat.name)
+        hints = self.model.get_unrepresented_flats(represented_persons)
         if hints:
             hint_str = ", ".join(hints)
             self.stdout.write(f"Should {name} also represent: {hint_str}?\n")
         self.set_prompt()
 
     def _choose_person(self, persons: Set[str]) -> Optional[str]:
-        options = ["New Person"] + sorted(persons)
+        options = ["New Person"] + reports.collation_index(self.model).sorted(persons)
         owner_index = choice_from("Select representation", options, self.stdout)
         if owner_index == -1:
             return None
@@ -198,9 +204,6 @@ class AppCmd(cmd.Cmd):
                 return None
         else:
             name = options[owner_index]
-        if not self.model.person_exists(name):
-            # Prevent creating already existing person.
-            self.model.add_person(name)
         return name
 
     complete_add = complete_flat
@@ -229,10 +232,8 @@ class AppCmd(cmd.Cmd):
             if len(flats) <= 1:
                 self._remove_person(person.name)
             else:
-                self.stdout.write(
-                    f"{flat.represented.name} no longer represents {flat.name}.\n"
-                )
                 self.model.remove_flat_representative(flat.name)
+                self.stdout.write(f"{person.name} no longer represents {flat.name}.\n")
             self.set_prompt()
             return
         try:
@@ -244,17 +245,20 @@ class AppCmd(cmd.Cmd):
     def complete_remove(
         self, text: str, line: str, beginx: int, endx: int
     ) -> List[str]:
-        flats = [
-            flat.name
-            for flat in self.model.flats
-            if flat.represented and flat.name.startswith(text)
-        ]
+        flats = self.model.get_represented_flats(text)
         return flats + self.model.get_person_names(text)
 
     def do_presence(self, args: str) -> None:
         """Prints presence into file."""
         reports.write_presence(self.model, args or "presence.html")
 
+    def do_stats(self, args: str) -> None:
+        """Prints latency statistics of commands."""
+        if self.latency_stats is None:
+            self.stdout.write("Statistics are disabled, start with --stats.\n")
+        else:
+            self.stdout.write(self.latency_stats.format())
+
     def do_quit(self, args: str) -> bool:
         """Quit the app."""
         return confirm("Really quit?")
@@ -266,21 +270,6 @@ class AppCmd(cmd.Cmd):
     do_EOF = do_quit
 
 
-def open_or_create_logfile(
-    logfile: TextIO, model: business.Building, default_filename: str
-) -> TextIO:
-    if not logfile:
-        try:
-            logfile = open(default_filename, "r+")
-        except IOError:
-            logfile = CommandLogger.create_logfile(default_filename)
-        else:
-            CommandLogger.parse_logfile(logfile, model)
-    else:
-        CommandLogger.parse_logfile(logfile, model)
-    return logfile
-
-
 def main() -> None:
     locale.setlocale(locale.LC_ALL, "cs_CZ.UTF-8")
     parser = argparse.ArgumentParser(
@@ -297,14 +286,135 @@ def main() -> None:
         type=argparse.FileType("r+"),
         help="the csv file with actions definition",
     )
+    parser.add_argument(
+        "--no-cache",
+        action="store_true",
+        help="don't use or create the converted flats cache next to the json file",
+    )
+    parser.add_argument(
+        "--snapshot-every",
+        metavar="N",
+        type=int,
+        default=SNAPSHOT_EVERY,
+        help="store the state after every N logged commands (0 disables)",
+    )
+    parser.add_argument(
+        "--group-commit",
+        action="store_true",
+        help="write the log from a background thread and sync it in batches",
+    )
+    parser.add_argument(
+        "--fsync-interval",
+        metavar="SECONDS",
+        type=float,
+        default=1.0,
+        help="the longest time before logged commands are synced with --group-commit",
+    )
+    parser.add_argument(
+        "--batch",
+        metavar="csvfile",
+        type=argparse.FileType("r"),
+        help="apply operations from the csv file instead of the console",
+    )
+    parser.add_argument(
+        "--serve",
+        metavar="address",
+        help="coordinate registration desks on host:port or unix:path",
+    )
+    parser.add_argument(
+        "--desk",
+        metavar="address",
+        help="register through the coordinator on host:port or unix:path",
+    )
+    parser.add_argument(
+        "--gathering",
+        metavar="ID",
+        help="the gathering to join with --desk when the service hosts several",
+    )
+    parser.add_argument(
+        "--dashboard",
+        metavar="host:port",
+        help="serve a live quorum page for a projector on the address",
+    )
+    parser.add_argument(
+        "--stats",
+        metavar="statsfile",
+        help="measure latency of commands and write it to the file on quit",
+    )
+    parser.add_argument(
+        "--verify-snapshot",
+        action="store_true",
+        help="check the state restored from a snapshot against a full log replay",
+    )
     args = parser.parse_args()
+    dashboard_address = None
+    if args.dashboard:
+        address = desks.parse_address(args.dashboard)
+        if isinstance(address, str):
+            parser.error("the dashboard needs host:port")
+        dashboard_address = address
     setup_readline_if_available()
-    json_flats = json.load(args.flats)
-    model = business.Building(utils.from_json_to_flats(json_flats))
+    flats = utils.load_flats(args.flats, not args.no_cache)
+    latency_stats = stats.LatencyStats() if args.stats else None
+    if args.desk:
+        # The coordinator logs all changes.
+        remote = desks.RemoteBuilding(
+            flats, desks.parse_address(args.desk), args.gathering
+        )
+        if latency_stats:
+            remote.register_stats(latency_stats)
+        server = None
+        if dashboard_address:
+            server = dashboard.start(remote, dashboard_address)
+            # The page changes with other desks also while this one is idle.
+            remote.follow()
+        try:
+            AppCmd(remote, latency_stats=latency_stats).cmdloop()
+        finally:
+            remote.close()
+            if server:
+                dashboard.stop(server)
+            if latency_stats:
+                latency_stats.dump(args.stats)
+        return
+    model = business.Building(flats)
     default_filename = CommandLogger.default_logname(args.flats.name)
-    logfile = open_or_create_logfile(args.log, model, default_filename)
-    model.register_logger(CommandLogger(logfile))
-    AppCmd(model).cmdloop()
+    logfile = open_or_create_logfile(
+        args.log, model, default_filename, args.verify_snapshot
+    )
+    snapshots = Snapshots(
+        Snapshots.default_filename(logfile.name), model, args.snapshot_every
+    )
+    logger: CommandLogger
+    if args.group_commit:
+        logger = DurableCommandLogger(logfile, snapshots, args.fsync_interval)
+    else:
+        logger = CommandLogger(logfile, snapshots)
+    model.register_logger(logger)
+    if latency_stats:
+        model.register_stats(latency_stats)
+    server = dashboard.start(model, dashboard_address) if dashboard_address else None
+    for signum in (signal.SIGTERM, signal.SIGHUP):
+        signal.signal(signum, _exit_on_signal)
+    try:
+        if args.serve:
+            desks.serve(model, desks.parse_address(args.serve))
+        elif args.batch:
+            summary = batch.run_batch(model, args.batch)
+            batch.write_summary(summary, model, sys.stdout)
+        else:
+            AppCmd(model, latency_stats=latency_stats).cmdloop()
+    finally:
+        if server:
+            dashboard.stop(server)
+        logger.close()
+        if latency_stats:
+            latency_stats.dump(args.stats)
+
+
+def _exit_on_signal(signum: int, frame: Optional[FrameType]) -> None:
+    # Unwinds the stack so the command log is flushed.
+    raise SystemExit(128 + signum)
 
 
 if __name__ == "__main__":
@@ -0,0 +1,114 @@
+"""
+Non-interactive registration from a prepared list of operations.
+
+The input is a CSV file with one operation per row:
+
+    add,<person>,<flat>[,<flat>...]   the person represents the flats
+    remove,<flat or person>           the same as the remove console command
+
+Empty rows and rows starting with # are ignored. Operations are applied
+directly to the Building, so they are logged by its CommandLogger.
+"""
+
+import csv
+import time
+from dataclasses import dataclass, field
+from typing import IO, List
+
+from shromazdeni import business
+
+
+class BatchError(Exception):
+    pass
+
+
+@dataclass
+class BatchSummary:
+    operations: int = 0
+    errors: List[str] = field(default_factory=list)
+    elapsed: float = 0.0
+
+    @property
+    def operations_per_second(self) -> float:
+        return self.operations / self.elapsed if self.elapsed else 0.0
+
+
+def run_batch(model: business.Building, fin: IO[str]) -> BatchSummary:
+    summary = BatchSummary()
+    start = time.perf_counter()
+    for line_no, row in enumerate(csv.reader(fin), start=1):
+        row = [value.strip() for value in row]
+        if not row or not row[0] or row[0].startswith("#"):
+            continue
+        try:
+            apply_operation(model, row)
+        except BatchError as error:
+            summary.errors.append(f"line {line_no}: {error}")
+        else:
+            summary.operations += 1
+    summary.elapsed = time.perf_counter() - start
+    return summary
+
+
+def apply_operation(model: business.Building, row: List[str]) -> None:
+    operation, args = row[0], row[1:]
+    if operation == "add":
+        if len(args) < 2:
+            raise BatchError('use "add,<person>,<flat>[,<flat>...]"')
+        represent_flats(model, args[0], args[1:])
+    elif operation == "remove":
+        if len(args) != 1:
+            raise BatchError('use "remove,<flat or person>"')
+        remove(model, args[0])
+    else:
+        raise BatchError(f'unknown operation "{operation}"')
+
+
+def represent_flats(
+    model: business.Building, person_name: str, flat_names: List[str]
+) -> None:
+    flats = []
+    for flat_name in flat_names:
+        try:
+            flat = model.get_flat(flat_name)
+        except KeyError:
+            raise BatchError(f'unit "{flat_name}" not found')
+        if flat.represented and flat.represented.name != person_name:
+            raise BatchError(
+                f"{flat_name} is already represented by {flat.represented.name}"
+            )
+        flats.append(flat)
+    if not model.person_exists(person_name):
+        model.add_person(person_name)
+    for flat in flats:
+        if not flat.represented:
+            model.represent_flat(flat.name, person_name)
+
+
+def remove(model: business.Building, name: str) -> None:
+    try:
+        flat = model.get_flat(name)
+    except KeyError:
+        if not model.person_exists(name):
+            raise BatchError(f'"{name}" is neither flat or person')
+        model.remove_person(name)
+        return
+    if not flat.represented:
+        raise BatchError(f'"{name}" is not represented')
+    person_name = flat.represented.name
+    if len(model.get_representative_flats(person_name)) <= 1:
+        model.remove_person(person_name)
+    else:
+        model.remove_flat_representative(flat.name)
+
+
+def write_summary(
+    summary: BatchSummary, model: business.Building, stdout: IO[str]
+) -> None:
+    for error in summary.errors:
+        stdout.write(f"{error}\n")
+    stdout.write(
+        f"Applied {summary.operations} operations, {len(summary.errors)} failed "
+        f"in {summary.elapsed:.3f} s ({summary.operations_per_second:.0f} ops/s).\n"
+        f"Represented {float(model.percent_represented):.1f}%.\n"
+    )
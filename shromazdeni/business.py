@@ -5,14 +5,54 @@ The module shouldn't depend on other parts of the package.
 """
 
 import re
+import bisect
 import collections
+import contextlib
+import dataclasses
 import fractions
+import functools
+import math
+import time
 from datetime import datetime
 from dataclasses import dataclass
-from typing import Any, Callable, cast, Dict, List, Optional, Set, Tuple, TypeVar
+from typing import (
+    Any,
+    Callable,
+    cast,
+    ContextManager,
+    Dict,
+    Iterable,
+    Iterator,
+    List,
+    Optional,
+    Set,
+    Tuple,
+    Type,
+    TypeVar,
+)
 from typing_extensions import Protocol
 
+T = TypeVar("T")
 
+
+def _with_slots(*extra_slots: str) -> Callable[[Type[T]], Type[T]]:
+    """Recreates a dataclass with __slots__ instead of per-instance dicts.
+
+    dataclass(slots=True) is available only since Python 3.10.
+    """
+
+    def decorator(cls: Any) -> Any:
+        field_names = tuple(f.name for f in dataclasses.fields(cls))
+        namespace = dict(cls.__dict__)
+        for name in field_names + ("__dict__", "__weakref__"):
+            namespace.pop(name, None)
+        namespace["__slots__"] = field_names + extra_slots
+        return type(cls)(cls.__name__, cls.__bases__, namespace)
+
+    return decorator
+
+
+@_with_slots()
 @dataclass
 class Person:
     """Represents a person present on the gathering."""
@@ -25,12 +65,14 @@ class Person:
         return isinstance(other, Person) and self.name == other.name
 
 
+@_with_slots()
 @dataclass
 class Owner:
     name: str
     fraction: fractions.Fraction = fractions.Fraction(1)
 
 
+@_with_slots("_sort_key")
 @dataclass
 class Flat:
     name: str
@@ -42,44 +84,156 @@ class Flat:
 
     @property
     def sort_key(self) -> Tuple[int, ...]:
-        return tuple(int(n) for n in re.split(r"/|-", self.name))
+        try:
+            return self._sort_key  # type: ignore
+        except AttributeError:
+            self._sort_key = tuple(int(n) for n in re.split(r"/|-", self.name))
+            return self._sort_key  # type: ignore
 
     @property
     def nice_name(self) -> str:
         return ("*" if self.represented else " ") + self.name
 
 
+class ConflictError(Exception):
+    """The change contradicts the current state, e.g. made by another desk."""
+
+
 class CommandLogger(Protocol):
     def log(self, func_name: str, args: Tuple) -> None:
         pass
 
 
+class CommandStats(Protocol):
+    def record(self, category: str, name: str, seconds: float) -> None:
+        pass
+
+
+class ChangeListener(Protocol):
+    def changed(self, model: "Building", func_name: str, args: Tuple) -> None:
+        pass
+
+
 FuncType = Callable[..., Any]
 F = TypeVar("F", bound=FuncType)
 
 
 def log_command(func: F) -> F:
     def wrapper(self: "Building", *args: str) -> Any:
+        stats = self._stats
+        if stats is None:
+            result = func(self, *args)
+            # On success
+            if self._logger:
+                self._logger.log(func.__name__, args)
+            for listener in self._listeners:
+                listener.changed(self, func.__name__, args)
+            return result
+        start = time.perf_counter()
         result = func(self, *args)
-        # On success
+        logged = time.perf_counter()
         if self._logger:
             self._logger.log(func.__name__, args)
+            stats.record("log", func.__name__, time.perf_counter() - logged)
+        stats.record("building", func.__name__, logged - start)
+        for listener in self._listeners:
+            listener.changed(self, func.__name__, args)
         return result
 
     return cast(F, wrapper)
 
 
+def _discard_from_index(index: Dict[str, Set[str]], key: str, value: str) -> None:
+    values = index[key]
+    values.discard(value)
+    if not values:
+        del index[key]
+
+
+class PrefixIndex:
+    """Sorted set of names answering prefix queries in O(log n + k)."""
+
+    def __init__(self, names: Iterable[str] = ()):
+        self._names = sorted(set(names))
+
+    def __len__(self) -> int:
+        return len(self._names)
+
+    def __iter__(self) -> Iterator[str]:
+        return iter(self._names)
+
+    def add(self, name: str) -> None:
+        i = bisect.bisect_left(self._names, name)
+        if i == len(self._names) or self._names[i] != name:
+            self._names.insert(i, name)
+
+    def remove(self, name: str) -> None:
+        i = bisect.bisect_left(self._names, name)
+        if i < len(self._names) and self._names[i] == name:
+            del self._names[i]
+
+    def startswith(self, prefix: str) -> List[str]:
+        i = bisect.bisect_left(self._names, prefix)
+        result = []
+        while i < len(self._names) and self._names[i].startswith(prefix):
+            result.append(self._names[i])
+            i += 1
+        return result
+
+
+def common_denominator(flats: Iterable[Flat]) -> int:
+    """Returns the least common multiple of all flat fraction denominators."""
+    return functools.reduce(
+        lambda a, b: a * b // math.gcd(a, b),
+        (flat.fraction.denominator for flat in flats),
+        1,
+    )
+
+
 class Building:
-    """Abstraction layer above json file from the parser."""
+    """Abstraction layer above json file from the parser.
 
-    def __init__(self, flats: List[Flat]):
+    Shares of flats are kept as integer numerators over one common
+    denominator, so summing them doesn't normalize fractions.
+    """
+
+    def __init__(self, flats: List[Flat], self_check: bool = False):
         self._flats = collections.OrderedDict((flat.name, flat) for flat in flats)
+        self._flat_order = {name: i for i, name in enumerate(self._flats)}
         self._present_persons: Dict[str, Person] = {}
         self._logger: Optional[CommandLogger] = None
+        self._stats: Optional[CommandStats] = None
+        self._listeners: List[ChangeListener] = []
+        self.denominator = common_denominator(flats)
+        self._shares = {
+            flat.name: flat.fraction.numerator
+            * (self.denominator // flat.fraction.denominator)
+            for flat in flats
+        }
+        # Indexes below are kept up to date by _set_representative,
+        # so queries don't depend on the number of flats.
+        self._represented_share = self._sum_represented_share()
+        self._representative_flats = self._build_representative_index()
+        self._unrepresented_flats = self._build_unrepresented_index()
+        self._flat_names = PrefixIndex(self._flats)
+        self._represented_names = PrefixIndex(
+            name for names in self._representative_flats.values() for name in names
+        )
+        self._person_names = PrefixIndex()
+        # Compares the indexes against a full recompute after each change.
+        self._self_check = self_check
 
     def register_logger(self, logger: CommandLogger) -> None:
         self._logger = logger
 
+    def register_stats(self, stats: CommandStats) -> None:
+        """Enables timing of logged commands and their log writes."""
+        self._stats = stats
+
+    def register_listener(self, listener: ChangeListener) -> None:
+        """Calls the listener after every logged command and loaded state."""
+        self._listeners.append(listener)
+
     @property
     def flats(self) -> List[Flat]:
         return list(self._flats.values())
@@ -88,21 +242,129 @@ class Building:
         return self._flats[shortname]
 
     @property
-    def percent_represented(self) -> float:
-        return sum(flat.fraction for flat in self.flats if flat.represented) * 100
+    def percent_represented(self) -> fractions.Fraction:
+        return fractions.Fraction(self._represented_share * 100, self.denominator)
+
+    @property
+    def represented_count(self) -> int:
+        return len(self._represented_names)
+
+    @property
+    def represented_share(self) -> int:
+        """Numerator of the represented fraction over the common denominator."""
+        return self._represented_share
+
+    def get_share(self, flat_name: str) -> int:
+        """Numerator of the flat fraction over the common denominator."""
+        return self._shares[flat_name]
+
+    def _sum_represented_share(self) -> int:
+        return sum(
+            self._shares[flat.name] for flat in self._flats.values() if flat.represented
+        )
+
+    def _build_representative_index(self) -> Dict[str, Set[str]]:
+        index: Dict[str, Set[str]] = collections.defaultdict(set)
+        for flat in self._flats.values():
+            if flat.represented:
+                index[flat.represented.name].add(flat.name)
+        return dict(index)
+
+    def _build_unrepresented_index(self) -> Dict[str, Set[str]]:
+        index: Dict[str, Set[str]] = collections.defaultdict(set)
+        for flat in self._flats.values():
+            if not flat.represented:
+                for person_name in flat.persons:
+                    index[person_name].add(flat.name)
+        return dict(index)
+
+    def check_consistency(self) -> None:
+        """Verifies that the indexes match a full recompute."""
+        expected = self._sum_represented_share()
+        assert self._represented_share == expected, (
+            f"represented share {self._represented_share} "
+            f"differs from recomputed {expected}"
+        )
+        expected_index = self._build_representative_index()
+        assert self._representative_flats == expected_index, (
+            f"representative index {self._representative_flats} "
+            f"differs from recomputed {expected_index}"
+        )
+        expected_index = self._build_unrepresented_index()
+        assert self._unrepresented_flats == expected_index, (
+            f"unrepresented index {self._unrepresented_flats} "
+            f"differs from recomputed {expected_index}"
+        )
+        expected_names = sorted(
+            flat.name for flat in self._flats.values() if flat.represented
+        )
+        assert list(self._represented_names) == expected_names, (
+            f"represented names {list(self._represented_names)} "
+            f"differ from recomputed {expected_names}"
+        )
+        assert list(self._person_names) == sorted(self._present_persons)
+
+    def _set_representative(self, flat: Flat, person: Optional[Person]) -> None:
+        previous = flat.represented
+        if previous:
+            self._represented_share -= self._shares[flat.name]
+            _discard_from_index(self._representative_flats, previous.name, flat.name)
+            self._represented_names.remove(flat.name)
+        elif person:
+            for person_name in flat.persons:
+                _discard_from_index(self._unrepresented_flats, person_name, flat.name)
+        flat.represented = person
+        if person:
+            self._represented_share += self._shares[flat.name]
+            self._representative_flats.setdefault(person.name, set()).add(flat.name)
+            self._represented_names.add(flat.name)
+        elif previous:
+            for person_name in flat.persons:
+                self._unrepresented_flats.setdefault(person_name, set()).add(flat.name)
+        if self._self_check:
+            self.check_consistency()
+
+    def _sorted_flat_names(self, names: Iterable[str]) -> List[str]:
+        return sorted(names, key=self._flat_order.__getitem__)
 
     @log_command
     def represent_flat(self, flat_name: str, person_name: str) -> None:
         person = self._present_persons[person_name]
-        self._flats[flat_name].represented = person
+        self._set_representative(self._flats[flat_name], person)
 
     def person_exists(self, name: str) -> bool:
         return name in self._present_persons
 
+    def get_person(self, name: str) -> Person:
+        return self._present_persons[name]
+
+    def sync(self) -> None:
+        """Applies changes made elsewhere, see desks.RemoteBuilding.
+
+        A local building is always up to date.
+        """
+
+    def exclusive(self) -> ContextManager:
+        """Keeps changes made elsewhere out until the context exits.
+
+        A local building changes only when the caller changes it.
+        """
+        return contextlib.nullcontext()
+
     @log_command
     def add_person(self, name: str) -> None:
         assert not self.person_exists(name)
         self._present_persons[name] = Person(name, datetime.now())
+        self._person_names.add(name)
+
+    def add_representative(self, name: str, flat_names: List[str]) -> None:
+        """Adds a new person representing the flats.
+
+        A desk sends it as one change, see desks.RemoteBuilding.
+        """
+        self.add_person(name)
+        for flat_name in flat_names:
+            self.represent_flat(flat_name, name)
 
     @log_command
     def remove_flat_representative(self, flat_name: str) -> None:
@@ -112,7 +374,7 @@ class Building:
             self._remove_flat_representative(flat_name)
 
     def _remove_flat_representative(self, flat_name: str) -> None:
-        self._flats[flat_name].represented = None
+        self._set_representative(self._flats[flat_name], None)
 
     @log_command
     def remove_person(self, name: str) -> List[str]:
@@ -120,22 +382,58 @@ class Building:
         for flat_name in person_flats:
             self._remove_flat_representative(flat_name)
         del self._present_persons[name]
+        self._person_names.remove(name)
+        if self._self_check:
+            self.check_consistency()
         return person_flats
 
+    def dump_state(self) -> Dict[str, Any]:
+        """Returns present persons and representation as plain JSON data."""
+        return {
+            "persons": {
+                name: person.created_at.isoformat()
+                for name, person in self._present_persons.items()
+            },
+            "flats": {
+                flat.name: flat.represented.name
+                for flat in self._flats.values()
+                if flat.represented
+            },
+        }
+
+    def load_state(self, state: Dict[str, Any]) -> None:
+        """Replaces present persons and representation by a dumped state."""
+        for flat in self._flats.values():
+            self._set_representative(flat, None)
+        self._present_persons = {
+            name: Person(name, datetime.fromisoformat(created_at))
+            for name, created_at in state["persons"].items()
+        }
+        self._person_names = PrefixIndex(self._present_persons)
+        for flat_name, person_name in state["flats"].items():
+            person = self._present_persons[person_name]
+            self._set_representative(self._flats[flat_name], person)
+        for listener in self._listeners:
+            listener.changed(self, "load_state", ())
+
     def get_representative_flats(self, person_name: str) -> List[str]:
-        return [
-            flat.name
-            for flat in self.flats
-            if flat.represented and flat.represented.name == person_name
-        ]
+        return self._sorted_flat_names(self._representative_flats.get(person_name, ()))
+
+    def get_flat_names(self, prefix: str) -> List[str]:
+        return self._flat_names.startswith(prefix)
+
+    def get_represented_flats(self, prefix: str) -> List[str]:
+        return self._represented_names.startswith(prefix)
 
     def get_person_names(self, prefix: str) -> List[str]:
-        return [n for n in self._present_persons if n.startswith(prefix)]
+        return self._person_names.startswith(prefix)
 
     def get_other_representatives(self, person_name: str) -> List[str]:
-        flats = []
-        for flat in self._flats.values():
-            if not flat.represented and person_name in flat.persons:
-                flats.append(flat.name)
-        flats.sort()
-        return flats
+        return sorted(self._unrepresented_flats.get(person_name, ()))
+
+    def get_unrepresented_flats(self, person_names: Iterable[str]) -> List[str]:
+        """Returns not represented flats owned by any of the persons."""
+        flat_names: Set[str] = set()
+        for person_name in person_names:
+            flat_names.update(self._unrepresented_flats.get(person_name, ()))
+        return self._sorted_flat_names(flat_names)
@@ -0,0 +1,335 @@
+"""
+Log of commands changing the building, used to recover after a restart.
+
+Every logged Building command is a csv row "time,operation,*args".
+Snapshots of the state allow replaying only the end of a long log.
+"""
+
+import csv
+import dataclasses
+import hashlib
+import json
+import os
+import pathlib
+import queue
+import threading
+import time
+import warnings
+from datetime import datetime
+from typing import Any, Dict, IO, List, NamedTuple, Optional, TextIO, Tuple, Union
+
+from shromazdeni import business
+
+
+SNAPSHOT_EVERY = 100
+
+
+class Snapshot(NamedTuple):
+    """The state after the log row which ends at offset."""
+
+    offset: int
+    state: Dict[str, Any]
+    # The start and checksum of the last covered row tie the snapshot to the log.
+    row_offset: int
+    row_hash: str
+
+
+def row_hash(row: List[str]) -> str:
+    return hashlib.sha1("\0".join(row).encode()).hexdigest()
+
+
+class Snapshots:
+    """Stores the building state together with the log offset it covers.
+
+    Recovery then loads the latest snapshot and replays only the rest of the log.
+    """
+
+    def __init__(
+        self,
+        filename: Union[str, pathlib.Path],
+        model: business.Building,
+        every: int = SNAPSHOT_EVERY,
+    ):
+        self.filename = filename
+        self._model = model
+        self._every = every
+        self._pending = 0
+
+    @staticmethod
+    def default_filename(log_filename: str) -> str:
+        return log_filename + ".snapshot"
+
+    def due(self) -> bool:
+        """Counts a logged command and tells whether a snapshot should be saved."""
+        self._pending += 1
+        if self._every > 0 and self._pending >= self._every:
+            self._pending = 0
+            return True
+        return False
+
+    def capture(self) -> Dict[str, Any]:
+        return self._model.dump_state()
+
+    def save(self, snapshot: Snapshot) -> None:
+        tmp_filename = f"{self.filename}.tmp"
+        with open(tmp_filename, "w") as fout:
+            json.dump(snapshot._asdict(), fout)
+        os.replace(tmp_filename, self.filename)
+
+    @staticmethod
+    def load(filename: Union[str, pathlib.Path]) -> Optional[Snapshot]:
+        try:
+            with open(filename) as fin:
+                return Snapshot(**json.load(fin))
+        except (IOError, ValueError, TypeError):
+            # Snapshots without the row checksum are not trusted either.
+            return None
+
+
+class CommandLogger:
+    def __init__(self, logfile: IO[str], snapshots: Optional[Snapshots] = None):
+        self._logfile = logfile
+        self._writer = csv.writer(logfile)
+        self._snapshots = snapshots
+
+    @staticmethod
+    def default_logname(flats_filename: str) -> str:
+        now = datetime.now().strftime("%Y%m%d")
+        filename, _ext = os.path.splitext(flats_filename)
+        filename += f".{now}.log"
+        return filename
+
+    @staticmethod
+    def parse_logfile(logfile: IO[str], model: business.Building) -> None:
+        reader = csv.reader(logfile)
+        next(reader)
+        CommandLogger._replay(reader, model)
+
+    @staticmethod
+    def _replay(reader: Any, model: business.Building) -> None:
+        for row in reader:
+            func = row[1]
+            getattr(model, func)(*row[2:])
+
+    @staticmethod
+    def parse_logfile_from_snapshot(
+        logfile: IO[str],
+        model: business.Building,
+        snapshot_filename: Union[str, pathlib.Path],
+        verify: bool = False,
+    ) -> None:
+        """Loads the latest valid snapshot and replays only the rest of the log.
+
+        With verify the result is compared against a full replay of the log
+        and the full replay wins on mismatch.
+        """
+        start = logfile.tell()
+        reference = None
+        if verify:
+            reference = business.Building(
+                [dataclasses.replace(flat, represented=None) for flat in model.flats]
+            )
+            CommandLogger.parse_logfile(logfile, reference)
+            logfile.seek(start)
+        snapshot = Snapshots.load(snapshot_filename)
+        if snapshot and _covers(logfile, snapshot):
+            model.load_state(snapshot.state)
+            logfile.seek(snapshot.offset)
+            CommandLogger._replay(csv.reader(logfile), model)
+        else:
+            logfile.seek(start)
+            CommandLogger.parse_logfile(logfile, model)
+        if reference and not _same_state(reference, model):
+            warnings.warn("Snapshot doesn't match the log, using full replay.")
+            model.load_state(reference.dump_state())
+
+    @staticmethod
+    def create_logfile(filename: Union[str, pathlib.Path]) -> TextIO:
+        # A snapshot of the previous log must not be applied to the new one.
+        try:
+            os.remove(Snapshots.default_filename(str(filename)))
+        except FileNotFoundError:
+            pass
+        fout = open(filename, "w")
+        writer = csv.writer(fout)
+        writer.writerow(["date", "operation", "*args"])
+        return fout
+
+    @staticmethod
+    def _make_row(func_name: str, args: Tuple) -> List[str]:
+        assert all(isinstance(arg, str) for arg in args)
+        now = datetime.now().strftime("%H:%M")
+        row = [now, func_name]
+        row += args
+        return row
+
+    def log(self, func_name: str, args: Tuple) -> None:
+        row = self._make_row(func_name, args)
+        if self._snapshots and self._snapshots.due():
+            row_offset = self._logfile.tell()
+            self._writer.writerow(row)
+            self._logfile.flush()
+            self._snapshots.save(
+                Snapshot(
+                    self._logfile.tell(),
+                    self._snapshots.capture(),
+                    row_offset,
+                    row_hash(row),
+                )
+            )
+        else:
+            self._writer.writerow(row)
+            self._logfile.flush()
+
+    def close(self) -> None:
+        self._logfile.flush()
+
+
+class DurableCommandLogger(CommandLogger):
+    """Logs commands through a writer thread which commits rows in groups.
+
+    Rows are written in batches and synced to disk every fsync_interval seconds
+    or fsync_rows rows, whichever comes first. The log format is the same as
+    of CommandLogger. close() must be called to write the remaining rows.
+    """
+
+    def __init__(
+        self,
+        logfile: IO[str],
+        snapshots: Optional[Snapshots] = None,
+        fsync_interval: float = 1.0,
+        fsync_rows: int = 100,
+    ):
+        super().__init__(logfile, snapshots)
+        self._fsync_interval = fsync_interval
+        self._fsync_rows = fsync_rows
+        self._queue: "queue.Queue[Tuple[str, Any]]" = queue.Queue()
+        self._error: Optional[BaseException] = None
+        self._thread = threading.Thread(
+            target=self._run, name="command-log-writer", daemon=True
+        )
+        self._thread.start()
+
+    def log(self, func_name: str, args: Tuple) -> None:
+        self._check_error()
+        row = self._make_row(func_name, args)
+        if self._snapshots and self._snapshots.due():
+            # The state has to be captured now, the offset once rows are written.
+            self._queue.put(("snapshot", (row, self._snapshots.capture())))
+        else:
+            self._queue.put(("row", row))
+
+    def flush(self) -> None:
+        """Waits until all logged rows are written and synced."""
+        done = threading.Event()
+        self._queue.put(("flush", done))
+        done.wait()
+        self._check_error()
+
+    def close(self) -> None:
+        if self._thread.is_alive():
+            self._queue.put(("close", None))
+            self._thread.join()
+        self._check_error()
+
+    def _check_error(self) -> None:
+        if self._error:
+            raise IOError("writing the command log failed") from self._error
+
+    def _run(self) -> None:
+        unsynced = 0
+        last_sync = time.monotonic()
+        running = True
+        while running:
+            timeout = max(0.0, last_sync + self._fsync_interval - time.monotonic())
+            try:
+                batch = [self._queue.get(timeout=timeout if unsynced else None)]
+            except queue.Empty:
+                batch = []
+            while True:
+                try:
+                    batch.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+            # Collected before writing, so an error can't leave anyone waiting.
+            waiting = [payload for kind, payload in batch if kind == "flush"]
+            if any(kind == "close" for kind, _payload in batch):
+                running = False
+            try:
+                for kind, payload in batch:
+                    if kind == "row":
+                        self._writer.writerow(payload)
+                        unsynced += 1
+                    elif kind == "snapshot" and self._snapshots:
+                        row, state = payload
+                        row_offset = self._logfile.tell()
+                        self._writer.writerow(row)
+                        self._sync()
+                        offset = self._logfile.tell()
+                        self._snapshots.save(
+                            Snapshot(offset, state, row_offset, row_hash(row))
+                        )
+                        unsynced = 0
+                now = time.monotonic()
+                if unsynced and (
+                    waiting
+                    or not running
+                    or unsynced >= self._fsync_rows
+                    or now - last_sync >= self._fsync_interval
+                ):
+                    self._sync()
+                    unsynced = 0
+                    last_sync = now
+            except Exception as error:
+                self._error = error
+            for done in waiting:
+                done.set()
+
+    def _sync(self) -> None:
+        self._logfile.flush()
+        try:
+            os.fsync(self._logfile.fileno())
+        except (AttributeError, OSError, ValueError):
+            # In memory files can't be synced.
+            pass
+
+
+def _covers(logfile: IO[str], snapshot: Snapshot) -> bool:
+    """Checks that the last row of the snapshot is in the log and ends at offset."""
+    logfile.seek(0, os.SEEK_END)
+    if not 0 < snapshot.row_offset < snapshot.offset <= logfile.tell():
+        return False
+    try:
+        logfile.seek(snapshot.row_offset)
+        line = logfile.readline()
+        if logfile.tell() != snapshot.offset:
+            return False
+    except (UnicodeDecodeError, ValueError):
+        return False
+    return row_hash(next(csv.reader([line]), [])) == snapshot.row_hash
+
+
+def _same_state(first: business.Building, second: business.Building) -> bool:
+    # Times of arrival are not compared as replay doesn't preserve them.
+    first_state = first.dump_state()
+    second_state = second.dump_state()
+    return first_state["flats"] == second_state["flats"] and set(
+        first_state["persons"]
+    ) == set(second_state["persons"])
+
+
+def open_or_create_logfile(
+    logfile: Optional[TextIO],
+    model: business.Building,
+    default_filename: str,
+    verify_snapshot: bool = False,
+) -> TextIO:
+    if not logfile:
+        try:
+            logfile = open(default_filename, "r+")
+        except IOError:
+            return CommandLogger.create_logfile(default_filename)
+    CommandLogger.parse_logfile_from_snapshot(
+        logfile, model, Snapshots.default_filename(logfile.name), verify_snapshot
+    )
+    return logfile
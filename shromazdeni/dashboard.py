@@ -0,0 +1,211 @@
+"""
+Live quorum view for a projector.
+
+A small HTTP server running next to the console. The page at / listens to
+server-sent events at /events. An event is sent after every change of the
+building, it carries only the summary, never the whole presence table:
+
+    data: {"percent": 52.3, "quorum": true, "represented": 41, "units": 80,
+           "arrivals": [{"name": "Petr Novák", "time": "18:02"}, ...]}
+"""
+
+import collections
+import json
+import queue
+import threading
+from http import HTTPStatus
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Deque, Dict, Optional, Set, Tuple
+
+from shromazdeni import business
+
+# The number of latest arrivals shown on the page.
+ARRIVALS = 10
+# Seconds between keep alive comments on an idle event stream.
+KEEPALIVE = 15.0
+
+PAGE = """<!DOCTYPE html>
+<html lang="cs">
+<head>
+<meta charset="utf-8">
+<title>Shromáždění</title>
+<style>
+body { font-family: sans-serif; text-align: center; }
+#percent { font-size: 12em; }
+.quorum { color: green; }
+.no-quorum { color: darkred; }
+ul { list-style: none; padding: 0; font-size: 2em; }
+</style>
+</head>
+<body>
+<div id="percent">-</div>
+<h2 id="units"></h2>
+<ul id="arrivals"></ul>
+<script>
+const source = new EventSource("events");
+source.onmessage = (message) => {
+  const data = JSON.parse(message.data);
+  const percent = document.getElementById("percent");
+  percent.textContent = data.percent.toFixed(1) + " %";
+  percent.className = data.quorum ? "quorum" : "no-quorum";
+  document.getElementById("units").textContent =
+    "Zastoupeno jednotek: " + data.represented + " z " + data.units;
+  const arrivals = document.getElementById("arrivals");
+  arrivals.replaceChildren(...data.arrivals.map((arrival) => {
+    const item = document.createElement("li");
+    item.textContent = arrival.time + " " + arrival.name;
+    return item;
+  }));
+};
+</script>
+</body>
+</html>
+"""
+
+
+class Dashboard:
+    """Turns building changes into events for all connected pages.
+
+    Every page has a queue holding only the latest event, so a slow page
+    skips intermediate states instead of delaying the console.
+    """
+
+    def __init__(self, model: business.Building, arrivals: int = ARRIVALS):
+        self._units = len(model.flats)
+        self._arrivals: Deque[Dict[str, str]] = collections.deque(maxlen=arrivals)
+        self._lock = threading.Lock()
+        self._clients: Set["queue.Queue[Optional[bytes]]"] = set()
+        self._load_arrivals(model)
+        self._event = self._encode(model)
+        model.register_listener(self)
+
+    def changed(self, model: business.Building, func_name: str, args: Tuple) -> None:
+        if func_name == "add_person":
+            self._arrivals.appendleft(self._arrival(model, args[0]))
+        elif func_name == "remove_person":
+            for arrival in list(self._arrivals):
+                if arrival["name"] == args[0]:
+                    self._arrivals.remove(arrival)
+        elif func_name == "load_state":
+            self._load_arrivals(model)
+        event = self._encode(model)
+        with self._lock:
+            self._event = event
+            for client in self._clients:
+                _replace(client, event)
+
+    def subscribe(self) -> "queue.Queue[Optional[bytes]]":
+        client: "queue.Queue[Optional[bytes]]" = queue.Queue(maxsize=1)
+        with self._lock:
+            client.put_nowait(self._event)
+            self._clients.add(client)
+        return client
+
+    def unsubscribe(self, client: "queue.Queue[Optional[bytes]]") -> None:
+        with self._lock:
+            self._clients.discard(client)
+
+    def close(self) -> None:
+        """Ends all event streams."""
+        with self._lock:
+            for client in self._clients:
+                _replace(client, None)
+            self._clients.clear()
+
+    def summary(self, model: business.Building) -> Dict[str, Any]:
+        percent = model.percent_represented
+        return {
+            "percent": float(percent),
+            "quorum": percent > 50,
+            "represented": model.represented_count,
+            "units": self._units,
+            "arrivals": list(self._arrivals),
+        }
+
+    def _encode(self, model: business.Building) -> bytes:
+        data = json.dumps(self.summary(model), ensure_ascii=False)
+        return f"data: {data}\n\n".encode()
+
+    def _load_arrivals(self, model: business.Building) -> None:
+        persons = sorted(model.dump_state()["persons"].items(), key=lambda p: p[1])
+        self._arrivals.clear()
+        # The bounded deque drops the earlier arrivals.
+        for name, _created_at in persons:
+            self._arrivals.appendleft(self._arrival(model, name))
+
+    @staticmethod
+    def _arrival(model: business.Building, name: str) -> Dict[str, str]:
+        created_at = model.get_person(name).created_at
+        return {"name": name, "time": created_at.strftime("%H:%M")}
+
+
+def _replace(client: "queue.Queue[Optional[bytes]]", event: Optional[bytes]) -> None:
+    # Only the dashboard puts into the queue and always under its lock.
+    try:
+        client.get_nowait()
+    except queue.Empty:
+        pass
+    client.put_nowait(event)
+
+
+class DashboardServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, address: Tuple[str, int], dashboard: Dashboard):
+        super().__init__(address, DashboardHandler)
+        self.dashboard = dashboard
+
+
+class DashboardHandler(BaseHTTPRequestHandler):
+    server: DashboardServer
+
+    def do_GET(self) -> None:
+        if self.path == "/":
+            body = PAGE.encode()
+            self.send_response(HTTPStatus.OK)
+            self.send_header("Content-Type", "text/html; charset=utf-8")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+        elif self.path == "/events":
+            self._stream_events()
+        else:
+            self.send_error(HTTPStatus.NOT_FOUND)
+
+    def _stream_events(self) -> None:
+        self.send_response(HTTPStatus.OK)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Cache-Control", "no-cache")
+        self.end_headers()
+        client = self.server.dashboard.subscribe()
+        try:
+            while True:
+                try:
+                    event = client.get(timeout=KEEPALIVE)
+                except queue.Empty:
+                    event = b": keepalive\n\n"
+                if event is None:
+                    break
+                self.wfile.write(event)
+                self.wfile.flush()
+        except (BrokenPipeError, ConnectionResetError):
+            pass
+        finally:
+            self.server.dashboard.unsubscribe(client)
+
+    def log_message(self, format: str, *args: Any) -> None:
+        # Keeps the console clean.
+        pass
+
+
+def start(model: business.Building, address: Tuple[str, int]) -> DashboardServer:
+    """Serves the dashboard from a background thread."""
+    server = DashboardServer(address, Dashboard(model))
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def stop(server: DashboardServer) -> None:
+    server.dashboard.close()
+    server.shutdown()
+    server.server_close()
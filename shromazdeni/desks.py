@@ -0,0 +1,428 @@
+"""
+Several registration desks sharing one gathering.
+
+The coordinator holds the authoritative Building and its command log.
+Desks keep a replica of the building for queries and completion and send
+every change to the coordinator. The coordinator applies changes one by one,
+rejects conflicting ones and broadcasts applied changes to all desks.
+
+The protocol is one JSON message per line over a unix or TCP socket:
+
+    desk -> coordinator  {"id": 1, "op": "represent_flat", "args": ["1", "Jan"]}
+    coordinator -> desk  {"id": 1, "ok": true, "result": null}
+                         {"id": 1, "ok": false, "error": "conflict", "message": ""}
+    coordinator -> desks {"event": "command", "op": ..., "args": [...], ...}
+
+Removals carry what the desk expects to remove in "expect", the current
+representative of the flat or the flats of the person, and conflict when
+the coordinator's building differs. "add_representative" with a new person
+and flats is applied as one change, either all of it or nothing.
+
+Right after connecting the coordinator sends {"event": "state", ...} with the
+building fingerprint and the current state.
+"""
+
+import asyncio
+import contextlib
+import hashlib
+import json
+import select
+import socket
+import threading
+from datetime import datetime
+from typing import Any, ContextManager, Dict, List, Optional, Set, Tuple, Union
+
+from shromazdeni import business
+
+# Operations of Building a desk can ask for, all of them are logged commands.
+COMMANDS = {
+    "add_person",
+    "represent_flat",
+    "remove_flat_representative",
+    "remove_person",
+}
+
+# Seconds a following desk waits for events before checking it wasn't closed.
+FOLLOW_TIMEOUT = 1.0
+
+Address = Union[str, Tuple[str, int]]
+
+
+class ProtocolError(Exception):
+    pass
+
+
+def parse_address(address: str) -> Address:
+    """Parses "unix:/path/to/socket" or "host:port"."""
+    if address.startswith("unix:"):
+        return address.split(":", 1)[1]
+    host, _sep, port = address.rpartition(":")
+    if not port.isdigit():
+        raise ValueError(f'invalid address "{address}", use host:port or unix:path')
+    return (host or "localhost", int(port))
+
+
+def building_fingerprint(model: business.Building) -> str:
+    """Identifies the loaded flats so desks can't join a different building."""
+    digest = hashlib.sha256()
+    for flat in model.flats:
+        digest.update(f"{flat.name}\0{flat.fraction}\0".encode())
+    return digest.hexdigest()
+
+
+def encode(message: Dict[str, Any]) -> bytes:
+    return json.dumps(message, ensure_ascii=False).encode() + b"\n"
+
+
+def state_event(model: business.Building) -> Dict[str, Any]:
+    return {
+        "event": "state",
+        "fingerprint": building_fingerprint(model),
+        "state": model.dump_state(),
+        "represented_share": model.represented_share,
+    }
+
+
+def execute(
+    model: business.Building, request: Dict[str, Any]
+) -> Tuple[Dict[str, Any], List[Dict[str, Any]]]:
+    """Applies a desk request to the authoritative building.
+
+    Returns the response for the desk and the events for all desks,
+    which are empty when the building didn't change.
+    """
+    request_id = request.get("id")
+    op = request.get("op")
+    args = request.get("args", [])
+    events: List[Dict[str, Any]] = []
+    try:
+        if op == "state":
+            return {"id": request_id, "ok": True, "result": state_event(model)}, []
+        if op not in COMMANDS and op != "add_representative":
+            raise ProtocolError(f'unknown operation "{op}"')
+        if not isinstance(args, list) or not all(isinstance(a, str) for a in args):
+            raise ProtocolError("arguments must be a list of strings")
+        if op == "add_representative":
+            _add_representative(model, args, events)
+            result = None
+        else:
+            result = _apply(model, op, args, request, events)
+    except business.ConflictError as error:
+        return error_response(request_id, "conflict", str(error)), []
+    except KeyError as error:
+        return error_response(request_id, "not_found", str(error.args[0])), []
+    except (ProtocolError, TypeError, ValueError) as error:
+        return error_response(request_id, "bad_request", str(error)), []
+    return {"id": request_id, "ok": True, "result": result}, events
+
+
+def _add_representative(
+    model: business.Building, args: List[str], events: List[Dict[str, Any]]
+) -> None:
+    name, *flat_names = args
+    # Checked up front, a conflict must not leave the new person behind.
+    for flat_name in flat_names:
+        _check_representative(model, flat_name, name)
+    _apply(model, "add_person", [name], {}, events)
+    for flat_name in flat_names:
+        _apply(model, "represent_flat", [flat_name, name], {}, events)
+
+
+def _check_representative(
+    model: business.Building, flat_name: str, person_name: str
+) -> None:
+    flat = model.get_flat(flat_name)
+    if flat.represented and flat.represented.name != person_name:
+        raise business.ConflictError(
+            f"{flat_name} is already represented by {flat.represented.name}"
+        )
+
+
+def _apply(
+    model: business.Building,
+    op: str,
+    args: List[str],
+    request: Dict[str, Any],
+    events: List[Dict[str, Any]],
+) -> Any:
+    if op == "add_person":
+        (name,) = args
+        if model.person_exists(name):
+            # Two desks may register the same person at once.
+            return None
+    elif op == "represent_flat":
+        flat_name, person_name = args
+        _check_representative(model, flat_name, person_name)
+        if model.get_flat(flat_name).represented:
+            return None
+    elif op == "remove_flat_representative":
+        (flat_name,) = args
+        represented = model.get_flat(flat_name).represented
+        current = represented.name if represented else None
+        if "expect" in request and request["expect"] != current:
+            raise business.ConflictError(
+                f"{flat_name} is now represented by {current}"
+                if current
+                else f"{flat_name} is no longer represented"
+            )
+        if not represented:
+            return None
+    elif op == "remove_person":
+        (name,) = args
+        flat_names = model.get_representative_flats(name)
+        if "expect" in request and request["expect"] != flat_names:
+            raise business.ConflictError(
+                f"{name} now represents {', '.join(flat_names) or 'no flat'}"
+            )
+    result = getattr(model, op)(*args)
+    event = {
+        "event": "command",
+        "op": op,
+        "args": args,
+        "represented_share": model.represented_share,
+    }
+    if op == "add_person":
+        person = model.get_person(args[0])
+        event["created_at"] = person.created_at.isoformat()
+    events.append(event)
+    return result
+
+
+def error_response(request_id: Any, error: str, message: str) -> Dict[str, Any]:
+    return {"id": request_id, "ok": False, "error": error, "message": message}
+
+
+class Coordinator:
+    """Serves desks of one gathering from an asyncio event loop.
+
+    The loop runs requests one at a time, so changes are serialized.
+    """
+
+    def __init__(self, model: business.Building):
+        self.model = model
+        self._writers: Set[asyncio.StreamWriter] = set()
+
+    async def start(self, address: Address) -> asyncio.AbstractServer:
+        if isinstance(address, str):
+            return await asyncio.start_unix_server(self.handle, path=address)
+        host, port = address
+        return await asyncio.start_server(self.handle, host, port)
+
+    async def handle(
+        self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter
+    ) -> None:
+        self._writers.add(writer)
+        try:
+            writer.write(encode(state_event(self.model)))
+            while True:
+                line = await reader.readline()
+                if not line:
+                    break
+                try:
+                    request = json.loads(line)
+                except ValueError:
+                    response = error_response(None, "bad_request", "invalid json")
+                else:
+                    response, events = execute(self.model, request)
+                    for event in events:
+                        self.broadcast(event)
+                writer.write(encode(response))
+                await writer.drain()
+        except ConnectionError:
+            pass
+        finally:
+            self._writers.discard(writer)
+            writer.close()
+
+    def broadcast(self, event: Dict[str, Any]) -> None:
+        # Sent before the response, so the requesting desk applies it first.
+        data = encode(event)
+        for writer in list(self._writers):
+            if writer.is_closing():
+                self._writers.discard(writer)
+            else:
+                writer.write(data)
+
+
+def serve(model: business.Building, address: Address) -> None:
+    """Runs the coordinator until interrupted."""
+
+    async def run() -> None:
+        server = await Coordinator(model).start(address)
+        async with server:
+            await server.serve_forever()
+
+    asyncio.run(run())
+
+
+class RemoteBuilding(business.Building):
+    """Replica of the coordinator's building used by a desk.
+
+    Changes are sent to the coordinator and applied locally only when
+    the coordinator broadcasts them. Changes made by other desks are applied
+    in sync(), which the console calls around every command, or as they come
+    from a background thread after follow().
+    """
+
+    def __init__(
+        self,
+        flats: List[business.Flat],
+        address: Address,
+        gathering: Optional[str] = None,
+    ):
+        super().__init__(flats)
+        self._socket = _connect(address)
+        self._buffer = b""
+        self._last_id = 0
+        # Responses read while waiting for another request, by request id.
+        self._responses: Dict[int, Dict[str, Any]] = {}
+        # Guards the socket and the replica against the following thread.
+        self._lock = threading.RLock()
+        self._follower: Optional[threading.Thread] = None
+        self._closing = False
+        if gathering is not None:
+            # A service hosting several gatherings, see shromazdeni.service.
+            self._socket.sendall(encode({"op": "join", "gathering": gathering}))
+        state = self._wait_message()
+        if state.get("event") != "state":
+            raise ProtocolError(state.get("message", f"expected state, got {state}"))
+        if state["fingerprint"] != building_fingerprint(self):
+            raise ProtocolError("the coordinator has loaded a different building")
+        self._apply_state(state)
+
+    def close(self) -> None:
+        self._closing = True
+        if self._follower:
+            with contextlib.suppress(OSError):
+                # Wakes up the following thread.
+                self._socket.shutdown(socket.SHUT_RDWR)
+            self._follower.join()
+        self._socket.close()
+
+    def follow(self) -> None:
+        """Applies changes of other desks as they come, e.g. for a dashboard."""
+        self._follower = threading.Thread(target=self._follow, daemon=True)
+        self._follower.start()
+
+    def _follow(self) -> None:
+        while not self._closing:
+            readable, _, _ = select.select([self._socket], [], [], FOLLOW_TIMEOUT)
+            if not readable:
+                continue
+            try:
+                self.sync()
+            except OSError:
+                # Closed, the console reports a lost coordinator on its own.
+                return
+
+    def exclusive(self) -> ContextManager:
+        return self._lock
+
+    def sync(self) -> None:
+        with self._lock:
+            while True:
+                message = self._read_message(block=False)
+                if message is None:
+                    return
+                self._handle_event(message)
+
+    def _request(self, op: str, args: Tuple[str, ...], **fields: Any) -> Any:
+        with self._lock:
+            self._last_id += 1
+            request_id = self._last_id
+            request = {"id": request_id, "op": op, "args": list(args), **fields}
+            self._socket.sendall(encode(request))
+            while request_id not in self._responses:
+                message = self._wait_message()
+                if "event" in message:
+                    # May resync with a nested request, which then reads our response.
+                    self._handle_event(message)
+                elif "id" in message:
+                    self._responses[message["id"]] = message
+            message = self._responses.pop(request_id)
+            if message["ok"]:
+                return message["result"]
+            if message["error"] == "conflict":
+                # The replica missed a change, so it has to start over.
+                self._apply_state(self._request("state", ()))
+                raise business.ConflictError(message["message"])
+            if message["error"] == "not_found":
+                raise KeyError(message["message"])
+            raise ProtocolError(message["message"])
+
+    def _handle_event(self, message: Dict[str, Any]) -> None:
+        if message.get("event") == "state":
+            self._apply_state(message)
+            return
+        if message.get("event") != "command":
+            return
+        op, args = message["op"], message["args"]
+        # Listeners see the change only with the coordinator's arrival time.
+        listeners, self._listeners = self._listeners, []
+        try:
+            getattr(business.Building, op)(self, *args)
+            if op == "add_person":
+                created_at = datetime.fromisoformat(message["created_at"])
+                self.get_person(args[0]).created_at = created_at
+        finally:
+            self._listeners = listeners
+        for listener in listeners:
+            listener.changed(self, op, tuple(args))
+        if self.represented_share != message["represented_share"]:
+            # The replica diverged, e.g. a message was lost; start over.
+            self._apply_state(self._request("state", ()))
+
+    def _apply_state(self, message: Dict[str, Any]) -> None:
+        self.load_state(message["state"])
+
+    def _wait_message(self) -> Dict[str, Any]:
+        message = self._read_message(block=True)
+        assert message is not None
+        return message
+
+    def _read_message(self, block: bool) -> Optional[Dict[str, Any]]:
+        while b"\n" not in self._buffer:
+            if not block:
+                readable, _, _ = select.select([self._socket], [], [], 0)
+                if not readable:
+                    return None
+            data = self._socket.recv(65536)
+            if not data:
+                raise ConnectionError("the coordinator closed the connection")
+            self._buffer += data
+        line, self._buffer = self._buffer.split(b"\n", 1)
+        message: Dict[str, Any] = json.loads(line)
+        return message
+
+    def represent_flat(self, flat_name: str, person_name: str) -> None:
+        self._request("represent_flat", (flat_name, person_name))
+
+    def add_person(self, name: str) -> None:
+        self._request("add_person", (name,))
+
+    def add_representative(self, name: str, flat_names: List[str]) -> None:
+        self._request("add_representative", (name, *flat_names))
+
+    def remove_flat_representative(self, flat_name: str) -> None:
+        represented = self.get_flat(flat_name).represented
+        self._request(
+            "remove_flat_representative",
+            (flat_name,),
+            expect=represented.name if represented else None,
+        )
+
+    def remove_person(self, name: str) -> List[str]:
+        result: List[str] = self._request(
+            "remove_person", (name,), expect=self.get_representative_flats(name)
+        )
+        return result
+
+
+def _connect(address: Address) -> socket.socket:
+    if isinstance(address, str):
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        sock.connect(address)
+    else:
+        sock = socket.create_connection(address)
+        sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+    return sock
@@ -1,3 +1,4 @@
-from .presence import write_presence, write_signatures
+from .presence import PAGE_ROWS, write_presence, write_signatures
+from .utils import collation_index
 
-__all__ = ["write_presence", "write_signatures"]
+__all__ = ["PAGE_ROWS", "collation_index", "write_presence", "write_signatures"]
@@ -1,6 +1,10 @@
+from concurrent import futures
 from datetime import datetime
 import enum
 import locale
+import os
+from typing import Dict, List, Optional, Set, Tuple
+import weakref
 
 from shromazdeni import business
 from shromazdeni.reports import utils
@@ -16,61 +20,186 @@ SIGNATURE_FIELDS = [utils.Field("PM", "ref"), utils.Field("Podpis", "ref")]
 
 FINAL_FIELDS = [utils.Field("Hlasuje", "owner"), utils.Field("Čas registrace", "time")]
 
+# Rows in one table, every table is printed on its own page.
+PAGE_ROWS = 40
+# Rows rendered by one worker task when rendering in parallel.
+CHUNK_ROWS = 2000
+# Fewer rows are rendered in-process even with jobs > 1. Starting the pool
+# costs ~12 ms and passing a row to a worker and back ~1.2 us in the parent,
+# rendering it ~2.5 us, so the pool pays off only on several cores and tens
+# of thousands of rows.
+PARALLEL_MIN_ROWS = 30000
+
 
 class ReportType(enum.Enum):
     SIGNATURE = enum.auto()
     FINAL = enum.auto()
 
 
-def write_presence(building: business.Building, filename: str) -> None:
-    _write_presence(building, filename, ReportType.FINAL)
+def write_presence(
+    building: business.Building,
+    filename: str,
+    page_rows: int = PAGE_ROWS,
+    jobs: int = 1,
+) -> None:
+    _write_presence(building, filename, ReportType.FINAL, page_rows, jobs)
 
 
-def write_signatures(building: business.Building, filename: str) -> None:
-    _write_presence(building, filename, ReportType.SIGNATURE)
+def write_signatures(
+    building: business.Building,
+    filename: str,
+    page_rows: int = PAGE_ROWS,
+    jobs: int = 1,
+) -> None:
+    """Writes the sheet in tables of page_rows rows (0 for one table).
 
+    With jobs > 1 rows of a large building are rendered by a pool of processes.
+    """
+    _write_presence(building, filename, ReportType.SIGNATURE, page_rows, jobs)
 
-def _write_presence(
-    building: business.Building, filename: str, kind: ReportType
-) -> None:
-    """Prints presence into file."""
-    rows = []
-    sum_share = 0.0
-    max_time = datetime.min
-    n_flats = 0
-    representatives = set()
-    for flat in building.flats:
-        if flat.represented:
-            repr_name = utils.convert_name(flat.represented.name)
-            time = flat.represented.created_at.strftime("%H:%M")
-            sum_share += float(flat.fraction)
-            max_time = max(max_time, flat.represented.created_at)
-            n_flats += 1
-            representatives.add(flat.represented.name)
-        else:
-            repr_name = ""
-            time = ""
 
-        names = " a ".join(utils.convert_name(owner.name) for owner in flat.owners)
-        share = float(flat.fraction)
-        if kind == ReportType.FINAL:
-            rows.append((names, flat.name, f"{share:.2%}", repr_name, time))
+class _RenderedReport:
+    """Rows of one building in the report order, rendered as html.
+
+    The order depends only on owners, so it is computed once. A row is
+    rendered again only when the representation of its flat changed.
+    """
+
+    def __init__(self, building: business.Building, kind: ReportType):
+        self.kind = kind
+        self.collation = locale.getlocale(locale.LC_COLLATE)
+        self.fields = PRESENCE_FIELDS + (
+            FINAL_FIELDS if kind == ReportType.FINAL else SIGNATURE_FIELDS
+        )
+        self.owners = {
+            flat.name: utils.owners_display_name(flat) for flat in building.flats
+        }
+        collation = utils.collation_index(building)
+        self.flats = sorted(
+            building.flats, key=lambda flat: collation.key(self.owners[flat.name])
+        )
+        # Flat name -> (representation the row was rendered for, html row).
+        self.rows: Dict[str, Tuple[Optional[Tuple[str, datetime]], str]] = {}
+
+    def render_rows(self, jobs: int = 1) -> List[str]:
+        stale = []
+        for flat in self.flats:
+            represented = None
+            if flat.represented and self.kind == ReportType.FINAL:
+                represented = (flat.represented.name, flat.represented.created_at)
+            cached = self.rows.get(flat.name)
+            if cached is None or cached[0] != represented:
+                stale.append((flat.name, represented, self._row(flat, represented)))
+        rows = [row for _name, _represented, row in stale]
+        if jobs > 1 and len(rows) >= PARALLEL_MIN_ROWS:
+            bounds = range(0, len(rows) + CHUNK_ROWS, CHUNK_ROWS)
+            chunks = [rows[start:end] for start, end in zip(bounds, bounds[1:])]
+            with futures.ProcessPoolExecutor(jobs) as pool:
+                rendered = pool.map(_render_rows, [self.fields] * len(chunks), chunks)
+                html_rows = [html for chunk in rendered for html in chunk]
         else:
-            rows.append((names, flat.name, f"{share:.2%}", "", ""))
-
-    rows.sort(key=lambda x: locale.strxfrm(x[0]))
-    if kind == ReportType.FINAL:
-        last_row = (
-            "Celkem",
-            n_flats,
-            f"{sum_share:.2%}",
-            str(len(representatives)),
-            max_time.strftime("%H:%M"),
+            html_rows = _render_rows(self.fields, rows)
+        for (name, represented, _row), html in zip(stale, html_rows):
+            self.rows[name] = (represented, html)
+        return [self.rows[flat.name][1] for flat in self.flats]
+
+    def _row(
+        self, flat: business.Flat, represented: Optional[Tuple[str, datetime]]
+    ) -> Tuple[str, ...]:
+        share = f"{float(flat.fraction):.2%}"
+        if represented:
+            repr_name, created_at = represented
+            return (
+                self.owners[flat.name],
+                flat.name,
+                share,
+                utils.convert_name(repr_name),
+                created_at.strftime("%H:%M"),
+            )
+        return (self.owners[flat.name], flat.name, share, "", "")
+
+
+def _render_rows(fields: List[utils.Field], rows: List[Tuple]) -> List[str]:
+    return [utils.render_row(fields, row) for row in rows]
+
+
+class _Totals:
+    """Running totals shown in the last row of every page."""
+
+    def __init__(self, building: business.Building, kind: ReportType):
+        self.building = building
+        self.kind = kind
+        self.units = 0
+        self.share = 0
+        self.represented_units = 0
+        self.representatives: Set[str] = set()
+        self.max_time = datetime.min
+
+    def add(self, flat: business.Flat) -> None:
+        self.units += 1
+        if self.kind == ReportType.SIGNATURE:
+            self.share += self.building.get_share(flat.name)
+        elif flat.represented:
+            self.share += self.building.get_share(flat.name)
+            self.represented_units += 1
+            self.representatives.add(flat.represented.name)
+            self.max_time = max(self.max_time, flat.represented.created_at)
+
+    def row(self, last: bool) -> Tuple:
+        label = "Celkem" if last else "Mezisoučet"
+        share = f"{self.share / self.building.denominator:.2%}"
+        if self.kind == ReportType.SIGNATURE:
+            return (label, self.units, "100%" if last else share, "", "")
+        return (
+            label,
+            self.represented_units,
+            share,
+            str(len(self.representatives)),
+            self.max_time.strftime("%H:%M"),
         )
-        fields = PRESENCE_FIELDS + FINAL_FIELDS
-    else:
-        last_row = ("Celkem", len(building.flats), "100%", "", "")
-        fields = PRESENCE_FIELDS + SIGNATURE_FIELDS
-    with open(filename, "w") as fout:
+
+
+_Reports = Dict[ReportType, _RenderedReport]
+# Kept only while the building lives.
+_reports: "weakref.WeakKeyDictionary[business.Building, _Reports]" = (
+    weakref.WeakKeyDictionary()
+)
+
+
+def _get_report(building: business.Building, kind: ReportType) -> _RenderedReport:
+    reports = _reports.setdefault(building, {})
+    report = reports.get(kind)
+    if report is None or report.collation != locale.getlocale(locale.LC_COLLATE):
+        report = reports[kind] = _RenderedReport(building, kind)
+    return report
+
+
+def _write_presence(
+    building: business.Building,
+    filename: str,
+    kind: ReportType,
+    page_rows: int = PAGE_ROWS,
+    jobs: int = 1,
+) -> None:
+    """Prints presence into file."""
+    report = _get_report(building, kind)
+    rows = report.render_rows(jobs)
+    page_rows = page_rows or len(rows) or 1
+    totals = _Totals(building, kind)
+    table_start = utils.table_start("Presenční listina", report.fields)
+    # Replaced at once, so a browser never shows a half written report.
+    tmp_filename = f"{filename}.tmp"
+    with open(tmp_filename, "w") as fout:
         fout.write(utils.CSS_STYLE)
-        utils.write_table(fout, rows, "Presenční listina", fields, last_row=last_row)
+        # An empty building still gets a table with the totals.
+        for start in range(0, max(len(rows), 1), page_rows):
+            end = start + page_rows
+            for flat in report.flats[start:end]:
+                totals.add(flat)
+            last_row = utils.render_last_row(
+                report.fields, totals.row(end >= len(rows))
+            )
+            fout.write(
+                "".join([table_start, *rows[start:end], last_row, utils.TABLE_END])
+            )
+    os.replace(tmp_filename, filename)
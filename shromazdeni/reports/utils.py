@@ -1,4 +1,9 @@
-from typing import IO, List, NamedTuple, Tuple
+import locale
+import weakref
+from typing import Dict, Iterable, List, NamedTuple, Optional, Tuple
+
+from shromazdeni import business
+from shromazdeni.utils import memoize_name
 
 
 CSS_STYLE = """
@@ -41,44 +46,88 @@ class Field(NamedTuple):
     style: str
 
 
-def write_table(
-    fout: IO[str], rows: List, header: str, fields: List[Field], last_row: Tuple = None
-) -> None:
-    fout.write(
-        f"""
+def table_start(header: str, fields: List[Field]) -> str:
+    columns = "".join(
+        f'<th class="{field.style}">{field.name}</th>' for field in fields
+    )
+    return f"""
 <h2>{header}</h2>
 <table>
 <thead>
-<tr>"""
-    )
-    for field in fields:
-        fout.write(f'<th class="{field.style}">{field.name}</th>')
-    fout.write(
-        """
+<tr>{columns}
 </tr>
 </thead>
 <tbody>"""
+
+
+TABLE_END = "</tbody></table>"
+
+
+def render_row(fields: List[Field], row: Tuple) -> str:
+    cells = []
+    for field, value in zip(fields, row):
+        if field.style == "owner" and " " in value:
+            surname, rest = value.split(" ", 1)
+            value = f'<span class="surname">{surname}</span> {rest}'
+        cells.append(f'<td class="{field.style}">{value}</td>')
+    return "<tr>" + "".join(cells) + "</tr>"
+
+
+def render_last_row(fields: List[Field], row: Tuple) -> str:
+    cells = "".join(
+        f'<td class="{field.style}">{value}</td>' for field, value in zip(fields, row)
     )
-    for row in rows:
-        fout.write("<tr>")
-        for field, value in zip(fields, row):
-            if field.style == "owner" and " " in value:
-                surname, rest = value.split(" ", 1)
-                value = f'<span class="surname">{surname}</span> {rest}'
-            fout.write(f'<td class="{field.style}">{value}</td>')
-        fout.write("</tr>")
-    if last_row:
-        fout.write('<tr class="last">')
-        for field, value in zip(fields, last_row):
-            fout.write(f'<td class="{field.style}">{value}</td>')
-        fout.write("</tr>")
-
-    fout.write("""</tbody></table>""")
+    return f'<tr class="last">{cells}</tr>'
 
 
+@memoize_name
 def convert_name(name: str) -> str:
     if name and "," in name:
         name, extra = name.split(",", 1)
     if name.startswith("SJM"):
         name = name[4:] + " SJM"
     return name
+
+
+def owners_display_name(flat: business.Flat) -> str:
+    return " a ".join(convert_name(owner.name) for owner in flat.owners)
+
+
+class CollationIndex:
+    """Collation keys of names shown in a building, computed once.
+
+    locale.strxfrm is slow for the Czech collation, so sorted views
+    (reports, persons in the console) look the keys up instead.
+    """
+
+    def __init__(self, building: business.Building):
+        self.collation = locale.getlocale(locale.LC_COLLATE)
+        self._keys: Dict[str, str] = {}
+        for flat in building.flats:
+            self.key(owners_display_name(flat))
+            for person in flat.persons:
+                self.key(person)
+
+    def key(self, name: str) -> str:
+        """Returns the collation key, names outside the building are added."""
+        try:
+            return self._keys[name]
+        except KeyError:
+            key = self._keys[name] = locale.strxfrm(name)
+            return key
+
+    def sorted(self, names: Iterable[str]) -> List[str]:
+        return sorted(names, key=self.key)
+
+
+_collation_indexes: "weakref.WeakKeyDictionary[business.Building, CollationIndex]" = (
+    weakref.WeakKeyDictionary()
+)
+
+
+def collation_index(building: business.Building) -> CollationIndex:
+    """Returns the index of the building, built on first use and on locale change."""
+    index: Optional[CollationIndex] = _collation_indexes.get(building)
+    if index is None or index.collation != locale.getlocale(locale.LC_COLLATE):
+        index = _collation_indexes[building] = CollationIndex(building)
+    return index
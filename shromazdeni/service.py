@@ -0,0 +1,245 @@
+"""
+One process hosting many gatherings at once.
+
+Every gathering has its own Building, command log and desks coordinator.
+The gatherings are listed in a json config:
+
+    {"<gathering id>": {"flats": "flats.json", "log": "optional.log"}, ...}
+
+Relative paths are relative to the config. A desk picks the gathering with
+the first message on the connection, then it speaks the protocol of
+shromazdeni.desks:
+
+    desk -> service  {"op": "join", "gathering": "<gathering id>"}
+    desk -> service  {"op": "gatherings"}
+
+Usage: python -m shromazdeni.service config.json --listen host:port
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import signal
+import sys
+from dataclasses import dataclass
+from types import FrameType
+from typing import Any, Dict, List, Optional
+
+from shromazdeni import business
+from shromazdeni import desks
+from shromazdeni import utils
+from shromazdeni.commandlog import (
+    CommandLogger,
+    Snapshots,
+    SNAPSHOT_EVERY,
+    open_or_create_logfile,
+)
+
+
+class ConfigError(Exception):
+    pass
+
+
+@dataclass
+class Gathering:
+    name: str
+    coordinator: desks.Coordinator
+    logger: CommandLogger
+
+    @property
+    def model(self) -> business.Building:
+        return self.coordinator.model
+
+
+def load_gathering(
+    name: str,
+    flats_filename: str,
+    log_filename: Optional[str] = None,
+    use_cache: bool = True,
+    snapshot_every: int = SNAPSHOT_EVERY,
+) -> Gathering:
+    """Loads the building and replays its log like the console does."""
+    with open(flats_filename, "rb") as fin:
+        model = business.Building(utils.load_flats(fin, use_cache))
+    log_filename = log_filename or CommandLogger.default_logname(flats_filename)
+    logfile = open_or_create_logfile(None, model, log_filename)
+    snapshots = Snapshots(
+        Snapshots.default_filename(logfile.name), model, snapshot_every
+    )
+    logger = CommandLogger(logfile, snapshots)
+    model.register_logger(logger)
+    return Gathering(name, desks.Coordinator(model), logger)
+
+
+def read_config(config_filename: str) -> Dict[str, Dict[str, Any]]:
+    with open(config_filename) as fin:
+        try:
+            config = json.load(fin)
+        except ValueError as error:
+            raise ConfigError(f"{config_filename}: {error}")
+    if not isinstance(config, dict):
+        raise ConfigError(f"{config_filename}: expected an object of gatherings")
+    base = os.path.dirname(os.path.abspath(config_filename))
+    result = {}
+    for name, entry in config.items():
+        if not isinstance(entry, dict) or "flats" not in entry:
+            raise ConfigError(f'gathering "{name}" has no flats')
+        result[name] = {
+            key: os.path.join(base, entry[key])
+            for key in ("flats", "log")
+            if key in entry
+        }
+    return result
+
+
+class GatheringService:
+    """Routes desk connections to coordinators of the hosted gatherings.
+
+    All coordinators share one event loop, so each gathering still handles
+    its requests one at a time.
+    """
+
+    def __init__(self, gatherings: List[Gathering]):
+        self.gatherings = {gathering.name: gathering for gathering in gatherings}
+
+    @classmethod
+    def from_config(
+        cls,
+        config_filename: str,
+        use_cache: bool = True,
+        snapshot_every: int = SNAPSHOT_EVERY,
+    ) -> "GatheringService":
+        gatherings = []
+        try:
+            for name, entry in read_config(config_filename).items():
+                gatherings.append(
+                    load_gathering(
+                        name,
+                        entry["flats"],
+                        entry.get("log"),
+                        use_cache,
+                        snapshot_every,
+                    )
+                )
+        except BaseException:
+            for gathering in gatherings:
+                gathering.logger.close()
+            raise
+        return cls(gatherings)
+
+    def close(self) -> None:
+        for gathering in self.gatherings.values():
+            gathering.logger.close()
+
+    def summary(self) -> List[Dict[str, Any]]:
+        return [
+            {
+                "gathering": name,
+                "represented_share": gathering.model.represented_share,
+                "percent_represented": float(gathering.model.percent_represented),
+            }
+            for name, gathering in sorted(self.gatherings.items())
+        ]
+
+    async def start(self, address: desks.Address) -> asyncio.AbstractServer:
+        if isinstance(address, str):
+            return await asyncio.start_unix_server(self.handle, path=address)
+        host, port = address
+        return await asyncio.start_server(self.handle, host, port)
+
+    async def handle(
+        self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter
+    ) -> None:
+        try:
+            line = await reader.readline()
+            try:
+                request = json.loads(line)
+            except ValueError:
+                request = None
+            if not isinstance(request, dict):
+                response = desks.error_response(None, "bad_request", "invalid json")
+            elif request.get("op") == "join":
+                name = str(request.get("gathering"))
+                gathering = self.gatherings.get(name)
+                if gathering:
+                    await gathering.coordinator.handle(reader, writer)
+                    return
+                response = desks.error_response(
+                    request.get("id"), "not_found", f'unknown gathering "{name}"'
+                )
+            elif request.get("op") == "gatherings":
+                response = {
+                    "id": request.get("id"),
+                    "ok": True,
+                    "result": self.summary(),
+                }
+            else:
+                response = desks.error_response(
+                    request.get("id"), "bad_request", "join a gathering first"
+                )
+            writer.write(desks.encode(response))
+            await writer.drain()
+        except ConnectionError:
+            pass
+        writer.close()
+
+
+def serve(service: GatheringService, address: desks.Address) -> None:
+    """Runs the service until interrupted."""
+
+    async def run() -> None:
+        server = await service.start(address)
+        async with server:
+            await server.serve_forever()
+
+    asyncio.run(run())
+
+
+def main(argv: List[str]) -> None:
+    parser = argparse.ArgumentParser(
+        description="Hosts registration of many gatherings in one process."
+    )
+    parser.add_argument("config", help="the json file listing the gatherings")
+    parser.add_argument(
+        "--listen",
+        metavar="address",
+        required=True,
+        help="serve desks on host:port or unix:path",
+    )
+    parser.add_argument(
+        "--no-cache",
+        action="store_true",
+        help="don't use or create the converted flats cache next to the json files",
+    )
+    parser.add_argument(
+        "--snapshot-every",
+        metavar="N",
+        type=int,
+        default=SNAPSHOT_EVERY,
+        help="store the state after every N logged commands (0 disables)",
+    )
+    args = parser.parse_args(argv)
+    try:
+        service = GatheringService.from_config(
+            args.config, not args.no_cache, args.snapshot_every
+        )
+    except (ConfigError, IOError) as error:
+        parser.error(str(error))
+    for signum in (signal.SIGTERM, signal.SIGHUP):
+        signal.signal(signum, _exit_on_signal)
+    try:
+        serve(service, desks.parse_address(args.listen))
+    except KeyboardInterrupt:
+        pass
+    finally:
+        service.close()
+
+
+def _exit_on_signal(signum: int, frame: Optional[FrameType]) -> None:
+    # Unwinds the stack so the command logs are flushed.
+    raise SystemExit(128 + signum)
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
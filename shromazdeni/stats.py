@@ -0,0 +1,93 @@
+"""
+Latency statistics of console commands, Building methods and log writes.
+
+Collected only when enabled, see AppCmd and Building.register_stats.
+"""
+
+import bisect
+import json
+from typing import Any, Dict, List, Tuple
+
+# Upper bounds of histogram buckets in seconds, the last bucket is unbounded.
+BUCKETS = (0.0001, 0.0005, 0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1.0)
+
+
+class Histogram:
+    """Counts of wall times in fixed buckets."""
+
+    def __init__(self) -> None:
+        self.counts = [0] * (len(BUCKETS) + 1)
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def add(self, seconds: float) -> None:
+        self.counts[bisect.bisect_left(BUCKETS, seconds)] += 1
+        self.count += 1
+        self.total += seconds
+        self.max = max(self.max, seconds)
+
+    def percentile(self, percent: float) -> float:
+        """Returns the upper bound of the bucket containing the percentile."""
+        threshold = self.count * percent / 100
+        seen = 0
+        for bound, count in zip(BUCKETS, self.counts):
+            seen += count
+            if seen >= threshold:
+                return min(bound, self.max)
+        return self.max
+
+    def as_dict(self) -> Dict[str, Any]:
+        return {
+            "count": self.count,
+            "total_s": self.total,
+            "mean_s": self.total / self.count if self.count else 0.0,
+            "max_s": self.max,
+            "p50_s": self.percentile(50),
+            "p95_s": self.percentile(95),
+            "buckets": {
+                f"<={bound}": count for bound, count in zip(BUCKETS, self.counts)
+            },
+            "slower": self.counts[-1],
+        }
+
+
+class LatencyStats:
+    """Wall time histograms grouped by category (command, building, log)."""
+
+    def __init__(self) -> None:
+        self._histograms: Dict[Tuple[str, str], Histogram] = {}
+
+    def record(self, category: str, name: str, seconds: float) -> None:
+        key = (category, name)
+        histogram = self._histograms.get(key)
+        if histogram is None:
+            histogram = self._histograms[key] = Histogram()
+        histogram.add(seconds)
+
+    def as_dict(self) -> Dict[str, Dict[str, Any]]:
+        result: Dict[str, Dict[str, Any]] = {}
+        for (category, name), histogram in sorted(self._histograms.items()):
+            result.setdefault(category, {})[name] = histogram.as_dict()
+        return result
+
+    def format(self) -> str:
+        lines: List[str] = []
+        if not self._histograms:
+            return "No statistics recorded yet.\n"
+        lines.append(
+            f"{'':10s} {'name':28s} {'count':>6s} {'mean ms':>8s} "
+            f"{'p95 ms':>8s} {'max ms':>8s}"
+        )
+        for (category, name), histogram in sorted(self._histograms.items()):
+            mean = histogram.total / histogram.count
+            lines.append(
+                f"{category:10s} {name:28s} {histogram.count:6d} "
+                f"{mean * 1000:8.2f} {histogram.percentile(95) * 1000:8.2f} "
+                f"{histogram.max * 1000:8.2f}"
+            )
+        return "\n".join(lines) + "\n"
+
+    def dump(self, filename: str) -> None:
+        with open(filename, "w") as fout:
+            json.dump(self.as_dict(), fout, indent=2)
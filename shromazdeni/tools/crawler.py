@@ -1,26 +1,73 @@
 """ Spider for parsing katastr nemovitosti.
 
 Output is owners of the units in the building.
+
+With --cache-dir every response (and the region lookup) is stored on disk,
+--replay then runs the whole crawl from the cache without network access
+and without the polite delay; a page missing in the cache fails the crawl.
+--base-url points the crawl to another server, e.g. a local one serving
+saved pages.
+
+With --previous the units added, removed or changed since the previous output
+are printed. Every unit is downloaded again, since the list of units doesn't
+show owners and so can't tell which units changed. Pages in --cache-dir are
+downloaded again too and replaced, unless --replay compares the cached ones.
+
+With --batch addresses.csv (rows "region,street,home_number") all buildings
+are crawled by one process into --job-dir, one json file per building.
+A building is written under its final name only when its crawl finished,
+so running the same command again continues with the remaining buildings.
+The crawls share the politeness of a single crawl: each of them sends one
+request at a time and waits --parallel times longer between requests.
+
+--format jsonl (the default for *.jsonl and for "-o -", which writes to stdout)
+writes one unit per line as soon as it is downloaded, so the output of an
+interrupted crawl stays readable and can be piped to other tools.
 """
 import argparse
+import csv
+import hashlib
 import json
+import os
+import re
+import sys
 import urllib.parse
 import urllib3
-from typing import Dict, List
+from typing import Any, Dict, Generator, IO, Iterable, List, NamedTuple, Optional
 
 import scrapy
 import scrapy.http as http
-from scrapy.crawler import CrawlerProcess
+from lxml import etree
+from scrapy.crawler import Crawler, CrawlerProcess
+from scrapy.extensions.httpcache import DummyPolicy
+from twisted.internet import defer
+
+from shromazdeni import utils
+
+
+# Rows of the owners table, compiled once instead of on every page.
+OWNER_ROWS = etree.XPath(
+    "//table[contains(concat(' ', normalize-space(@class), ' '), ' vlastnici ')]//tr"
+)
 
 
 def parse_owners(response: http.TextResponse) -> List[Dict]:
-    rows = response.css("table.vlastnici tr")
-    owners: List[Dict[str, str]] = []
+    """Reads the owners table in one pass over the lxml tree of the page."""
+    owners: List[Dict[str, Optional[str]]] = []
     person_index = 0
 
-    for row in rows[1:]:
-        if row.css(".partnerSJM"):
-            person = row.xpath(".//i/text()").get()
+    for row in OWNER_ROWS(response.selector.root)[1:]:
+        partner = False
+        person = fraction = None
+        for element in row.iter(tag=etree.Element):
+            classes = (element.get("class") or "").split()
+            if "partnerSJM" in classes:
+                partner = True
+            if person is None and element.tag == "i":
+                person = _first_text(element)
+            if fraction is None and "right" in classes:
+                fraction = _first_text(element)
+        if partner:
             if person_index == 0:
                 owners[-1]["person1"] = person
             else:
@@ -28,25 +75,55 @@ def parse_owners(response: http.TextResponse) -> List[Dict]:
             person_index += 1
         else:
             person_index = 0
-            name = row.xpath("td[1]/text()").get()
+            cell = row.find("td")
+            name = None if cell is None else _first_text(cell)
             if not name:
                 # we are reading another header - different part of the table
                 break
-            fraction_el = row.css(".right").xpath("text()").get()
-            owners.append({"name": name, "fraction": fraction_el or "1"})
+            owners.append({"name": name, "fraction": fraction or "1"})
     return owners
 
 
+def _first_text(element: Any) -> Optional[str]:
+    """Returns the same as element.xpath("text()").get()."""
+    if element.text:
+        return str(element.text)
+    for child in element:
+        if child.tail:
+            return str(child.tail)
+    return None
+
+
+BASE_URL = "https://nahlizenidokn.cuzk.cz"
+DOWNLOAD_DELAY = 1.0
+# Region lookups are stored next to the cached responses.
+REGIONS_FILENAME = "regions.json"
+# Buildings crawled at once in the batch mode, also the requests sent at once.
+BATCH_PARALLEL = 2
+# Scrapy feed exporters by the --format option.
+FEED_FORMATS = {"json": "json", "jsonl": "jsonlines"}
+
+
 class KatastrSpider(scrapy.Spider):
     name: str = "katastr"  # type: ignore
-    start_urls = ["https://nahlizenidokn.cuzk.cz/VyberBudovu.aspx?typ=Jednotka"]
-    download_delay = 1.0
+    start_urls = [f"{BASE_URL}/VyberBudovu.aspx?typ=Jednotka"]
+    download_delay = DOWNLOAD_DELAY
     allowed_domains = ["nahlizenidokn.cuzk.cz"]
 
-    def __init__(self, region: str, street: str, home_number: str):
+    def __init__(
+        self,
+        region: str,
+        street: str,
+        home_number: str,
+        base_url: str = BASE_URL,
+        download_delay: float = DOWNLOAD_DELAY,
+    ):
         self.region = region
         self.street = street
         self.home_number = home_number
+        self.start_urls = [f"{base_url}/VyberBudovu.aspx?typ=Jednotka"]
+        self.allowed_domains = [urllib.parse.urlsplit(base_url).hostname or ""]
+        self.download_delay = download_delay
 
     def parse(self, response: http.TextResponse) -> http.FormRequest:
         yield scrapy.FormRequest.from_response(
@@ -82,52 +159,434 @@ class KatastrSpider(scrapy.Spider):
 
     def parse_flat(self, response: http.TextResponse) -> http.FormRequest:
         table = response.xpath("//table[@summary='Atributy jednotky']")
-        yield {
+        unit = {
             "name": table.xpath("tr[1]/td[2]/strong/text()").get(),
             "fraction": table.xpath("tr[last()]/td[2]/text()").get(),
             "owners": parse_owners(response),
         }
+        unit["content_hash"] = hash_content(unit)
+        yield unit
 
 
-def download_building(
-    file_name: str, street: str, home_number: str, region: str
-) -> None:
-    process = CrawlerProcess(settings={"FEED_URI": file_name, "FEED_FORMAT": "json"})
-    pool = urllib3.PoolManager()
-    response = pool.request(
-        "GET",
-        "https://nahlizenidokn.cuzk.cz/AutoCompleteObecHandler.ashx?{}".format(
-            urllib.parse.urlencode({"query": region})
-        ),
+def hash_content(unit: Dict) -> str:
+    content = {key: unit[key] for key in ("name", "fraction", "owners")}
+    data = json.dumps(content, sort_keys=True, ensure_ascii=False)
+    return hashlib.sha1(data.encode()).hexdigest()
+
+
+class Changes(NamedTuple):
+    added: List[str]
+    removed: List[str]
+    changed: List[str]
+    unchanged: int
+
+
+def compare_crawls(previous: Iterable[Dict], current: Iterable[Dict]) -> Changes:
+    """Compares units of two crawls by their names and content."""
+    old = _content_hashes(previous)
+    new = _content_hashes(current)
+    common = new.keys() & old.keys()
+    changed = sorted(name for name in common if new[name] != old[name])
+    return Changes(
+        added=sorted(new.keys() - old.keys()),
+        removed=sorted(old.keys() - new.keys()),
+        changed=changed,
+        unchanged=len(common) - len(changed),
+    )
+
+
+def _content_hashes(units: Iterable[Dict]) -> Dict[str, str]:
+    return {
+        unit["name"]: unit.get("content_hash") or hash_content(unit) for unit in units
+    }
+
+
+def write_changes(changes: Changes, fout: IO[str]) -> None:
+    for label, names in [
+        ("Added", changes.added),
+        ("Removed", changes.removed),
+        ("Changed", changes.changed),
+    ]:
+        if names:
+            fout.write(f"{label} units: {', '.join(names)}\n")
+    fout.write(
+        f"{len(changes.added)} added, {len(changes.removed)} removed, "
+        f"{len(changes.changed)} changed, {changes.unchanged} unchanged.\n"
     )
-    regions = json.loads(response.data)["suggestions"]
+
+
+class CacheMissError(Exception):
+    pass
+
+
+class RefreshPolicy(DummyPolicy):
+    """Downloads every page again and replaces the cached one."""
+
+    def is_cached_response_fresh(self, cachedresponse: Any, request: Any) -> bool:
+        return False
+
+    def is_cached_response_valid(
+        self, cachedresponse: Any, response: Any, request: Any
+    ) -> bool:
+        return False
+
+
+def check_cache_misses(crawler: Crawler) -> None:
+    """Fails a replayed crawl which dropped requests missing in the cache."""
+    misses = crawler.stats.get_value("httpcache/miss", 0)
+    if misses:
+        raise CacheMissError(
+            f"{misses} requests are not in the cache, the output is incomplete"
+        )
+
+
+def output_format(file_name: str) -> str:
+    """Guesses --format from the output file name."""
+    return "jsonl" if file_name == "-" or file_name.endswith(".jsonl") else "json"
+
+
+def crawler_settings(
+    file_name: str,
+    cache_dir: Optional[str] = None,
+    replay: bool = False,
+    feed_format: str = "json",
+    refresh: bool = False,
+) -> Dict[str, Any]:
+    settings: Dict[str, Any] = {
+        "FEED_URI": "stdout:" if file_name == "-" else file_name,
+        "FEED_FORMAT": FEED_FORMATS[feed_format],
+        "FEED_EXPORT_ENCODING": "utf-8",
+    }
+    if cache_dir:
+        settings.update(
+            {
+                "HTTPCACHE_ENABLED": True,
+                "HTTPCACHE_DIR": os.path.abspath(cache_dir),
+                # Pages of the cadastre don't change during a crawl,
+                # so everything is cached regardless of cache headers.
+                "HTTPCACHE_POLICY": "scrapy.extensions.httpcache.DummyPolicy",
+                "HTTPCACHE_EXPIRATION_SECS": 0,
+                "HTTPCACHE_IGNORE_HTTP_CODES": [500, 502, 503, 504],
+                # Without it a cache miss would go to the network. Dropped
+                # requests are counted as misses, see check_cache_misses.
+                "HTTPCACHE_IGNORE_MISSING": replay,
+            }
+        )
+        if refresh and not replay:
+            # A cached page would hide the changes --previous looks for.
+            settings["HTTPCACHE_POLICY"] = RefreshPolicy
+    return settings
+
+
+def find_region(
+    region: str,
+    base_url: str = BASE_URL,
+    cache_dir: Optional[str] = None,
+    replay: bool = False,
+) -> str:
+    """Returns the full region name suggested by the autocomplete."""
+    cache: Dict[str, List[str]] = {}
+    cache_filename = os.path.join(cache_dir, REGIONS_FILENAME) if cache_dir else None
+    if cache_filename and os.path.exists(cache_filename):
+        with open(cache_filename) as fin:
+            cache = json.load(fin)
+    if region in cache:
+        regions = cache[region]
+    elif replay:
+        raise CacheMissError(f'region "{region}" is not in the cache')
+    else:
+        pool = urllib3.PoolManager()
+        response = pool.request(
+            "GET",
+            "{}/AutoCompleteObecHandler.ashx?{}".format(
+                base_url, urllib.parse.urlencode({"query": region})
+            ),
+        )
+        regions = json.loads(response.data)["suggestions"]
+        if cache_filename:
+            cache[region] = regions
+            os.makedirs(os.path.dirname(cache_filename), exist_ok=True)
+            with open(cache_filename, "w") as fout:
+                json.dump(cache, fout, ensure_ascii=False, indent=2)
     if len(regions) != 1:
         raise ValueError("Different number of regions then 1: {}".format(regions))
-    full_region = regions[0]
+    return regions[0]
+
+
+def download_building(
+    file_name: str,
+    street: str,
+    home_number: str,
+    region: str,
+    base_url: str = BASE_URL,
+    cache_dir: Optional[str] = None,
+    replay: bool = False,
+    download_delay: float = DOWNLOAD_DELAY,
+    previous_file_name: Optional[str] = None,
+    feed_format: Optional[str] = None,
+) -> None:
+    if replay and not cache_dir:
+        raise ValueError("replay needs the cache directory")
+    if previous_file_name and file_name == "-":
+        raise ValueError("changes against the previous crawl need an output file")
+    previous_units: List[Dict] = []
+    if previous_file_name:
+        with open(previous_file_name, "rb") as fin:
+            previous_units = list(utils.iter_json_flats(fin))
+    feed_format = feed_format or output_format(file_name)
+    settings = crawler_settings(
+        file_name, cache_dir, replay, feed_format, refresh=bool(previous_file_name)
+    )
+    process = CrawlerProcess(settings=settings)
+    full_region = find_region(region, base_url, cache_dir, replay)
+    crawler = process.create_crawler(KatastrSpider)
     process.crawl(
-        KatastrSpider, region=full_region, street=street, home_number=home_number
+        crawler,
+        region=full_region,
+        street=street,
+        home_number=home_number,
+        base_url=base_url,
+        # Nothing is downloaded, so there is no server to be polite to.
+        download_delay=0.0 if replay else download_delay,
     )
     process.start()
+    if replay:
+        check_cache_misses(crawler)
+    if previous_file_name:
+        with open(file_name, "rb") as fin:
+            changes = compare_crawls(previous_units, utils.iter_json_flats(fin))
+        write_changes(changes, sys.stdout)
+
+
+class Address(NamedTuple):
+    region: str
+    street: str
+    home_number: str
+
+    @property
+    def slug(self) -> str:
+        name = f"{self.region}-{self.street}-{self.home_number}"
+        return re.sub(r"[^\w.-]+", "_", name).strip("_")
+
+
+def read_addresses(fin: IO[str]) -> List[Address]:
+    addresses = []
+    for row in csv.reader(fin):
+        row = [value.strip() for value in row]
+        if not row or not row[0] or row[0].startswith("#"):
+            continue
+        if len(row) != 3:
+            raise ValueError(f"expected region,street,home_number, got {row}")
+        addresses.append(Address(*row))
+    return addresses
+
+
+def batch_settings(
+    cache_dir: Optional[str],
+    replay: bool,
+    download_delay: float,
+    feed_format: str = "json",
+    parallel: int = BATCH_PARALLEL,
+) -> Dict[str, Any]:
+    """Settings of every crawl in the batch.
+
+    Every crawl has its own downloader and throttling, so the delays are
+    multiplied by parallel to keep the load of the server of a single crawl.
+    """
+    settings = crawler_settings("", cache_dir, replay, feed_format)
+    del settings["FEED_URI"]
+    if not replay:
+        # Adapts the delay to the server latency, never under download_delay.
+        settings.update(
+            {
+                "AUTOTHROTTLE_ENABLED": True,
+                "AUTOTHROTTLE_START_DELAY": max(download_delay, 1.0) * parallel,
+                "AUTOTHROTTLE_MAX_DELAY": 60.0 * parallel,
+                "AUTOTHROTTLE_TARGET_CONCURRENCY": 1.0,
+                "CONCURRENT_REQUESTS_PER_DOMAIN": 1,
+            }
+        )
+    return settings
+
+
+def download_buildings(
+    addresses: List[Address],
+    job_dir: str,
+    base_url: str = BASE_URL,
+    cache_dir: Optional[str] = None,
+    replay: bool = False,
+    download_delay: float = DOWNLOAD_DELAY,
+    parallel: int = BATCH_PARALLEL,
+    feed_format: str = "json",
+) -> List[str]:
+    """Crawls the buildings in one reactor, returns the errors.
+
+    Buildings with an output file in job_dir are skipped.
+    """
+    os.makedirs(job_dir, exist_ok=True)
+    cache_dir = cache_dir or os.path.join(job_dir, "httpcache")
+    parallel = max(parallel, 1)
+    settings = batch_settings(cache_dir, replay, download_delay, feed_format, parallel)
+    process = CrawlerProcess(settings=settings)
+    errors: List[str] = []
+    regions: Dict[str, str] = {}
+    pending = []
+    for address in addresses:
+        if os.path.exists(os.path.join(job_dir, f"{address.slug}.{feed_format}")):
+            continue
+        # Buildings in the same region share the lookup.
+        if address.region not in regions:
+            try:
+                regions[address.region] = find_region(
+                    address.region, base_url, cache_dir, replay
+                )
+            except (CacheMissError, ValueError) as error:
+                errors.append(f"{address.slug}: {error}")
+                continue
+        pending.append(address)
+    semaphore = defer.DeferredSemaphore(parallel)
+
+    @defer.inlineCallbacks
+    def crawl(address: Address) -> Generator[defer.Deferred, None, None]:
+        file_name = os.path.join(job_dir, f"{address.slug}.{feed_format}")
+        part_name = f"{file_name}.part"
+        # Scrapy appends to an existing file, e.g. left by an interrupted run.
+        if os.path.exists(part_name):
+            os.remove(part_name)
+        crawler = Crawler(KatastrSpider, dict(settings, FEED_URI=part_name))
+        try:
+            yield process.crawl(
+                crawler,
+                region=regions[address.region],
+                street=address.street,
+                home_number=address.home_number,
+                base_url=base_url,
+                download_delay=0.0 if replay else download_delay * parallel,
+            )
+        except Exception as error:
+            # The other buildings go on, the batch fails at the end.
+            errors.append(f"{address.slug}: crawl failed: {error!r}")
+            return
+        if replay:
+            try:
+                check_cache_misses(crawler)
+            except CacheMissError as error:
+                errors.append(f"{address.slug}: {error}")
+                return
+        reason = crawler.stats.get_value("finish_reason")
+        if reason == "finished":
+            os.replace(part_name, file_name)
+        else:
+            errors.append(f"{address.slug}: crawl ended with {reason}")
+
+    def stop(result: Any) -> Any:
+        from twisted.internet import reactor
+
+        reactor.stop()  # type: ignore
+        return result
+
+    if pending:
+        crawls = [semaphore.run(crawl, address) for address in pending]
+        defer.DeferredList(crawls).addBoth(stop)
+        process.start(stop_after_crawl=False)
+    return errors
 
 
 def main() -> None:
     parser = argparse.ArgumentParser(
         description="Download flat information from katasrt nemovitosti"
     )
-    parser.add_argument("--region", required=True, help="Name of region e.g. Praha")
+    parser.add_argument("--region", help="Name of region e.g. Praha")
+    parser.add_argument("--street", help="Exact name of the street with diacritics")
+    parser.add_argument("--home_number", help="Home number")
     parser.add_argument(
-        "--street", required=True, help="Exact name of the street with diacritics"
+        "--batch",
+        type=argparse.FileType("r"),
+        help="CSV with region,street,home_number of buildings to download",
+    )
+    parser.add_argument(
+        "--job-dir", help="Output directory of --batch, rerun to resume"
+    )
+    parser.add_argument(
+        "--parallel",
+        type=int,
+        default=BATCH_PARALLEL,
+        help="Buildings downloaded at once with --batch, sharing the delay",
+    )
+    parser.add_argument(
+        "-o", "--output", help="Output filename, - for stdout", default="flats.json"
+    )
+    parser.add_argument(
+        "--format",
+        choices=sorted(FEED_FORMATS),
+        help="json array or JSON Lines, by default guessed from the output name",
+    )
+    parser.add_argument(
+        "--cache-dir", help="Store responses in the directory and reuse them"
+    )
+    parser.add_argument(
+        "--replay",
+        action="store_true",
+        help="Use only responses from --cache-dir, never the network",
+    )
+    parser.add_argument(
+        "--base-url",
+        default=BASE_URL,
+        help="Server to crawl instead of the cadastre, e.g. a local fixture server",
+    )
+    parser.add_argument(
+        "--previous",
+        help="Output of a previous crawl, print the units changed since then",
+    )
+    parser.add_argument(
+        "--delay",
+        type=float,
+        default=DOWNLOAD_DELAY,
+        help="Seconds between requests to the server",
     )
-    parser.add_argument("--home_number", required=True, help="Home number")
-    parser.add_argument("-o", "--output", help="Output filename", default="flats.json")
 
     args = parser.parse_args()
-    download_building(
-        args.output,
-        region=args.region,
-        street=args.street,
-        home_number=args.home_number,
-    )
+    if args.batch:
+        if not args.job_dir:
+            parser.error("--batch needs --job-dir")
+        try:
+            addresses = read_addresses(args.batch)
+        except ValueError as error:
+            parser.error(str(error))
+        errors = download_buildings(
+            addresses,
+            args.job_dir,
+            base_url=args.base_url.rstrip("/"),
+            cache_dir=args.cache_dir,
+            replay=args.replay,
+            download_delay=args.delay,
+            parallel=args.parallel,
+            feed_format=args.format or "json",
+        )
+        for message in errors:
+            print(message, file=sys.stderr)
+        sys.exit(1 if errors else 0)
+    if not (args.region and args.street and args.home_number):
+        parser.error("--region, --street and --home_number are required")
+    if args.replay and not args.cache_dir:
+        parser.error("--replay needs --cache-dir")
+    if args.previous and args.output == "-":
+        parser.error("--previous needs --output file")
+    try:
+        download_building(
+            args.output,
+            region=args.region,
+            street=args.street,
+            home_number=args.home_number,
+            base_url=args.base_url.rstrip("/"),
+            cache_dir=args.cache_dir,
+            replay=args.replay,
+            download_delay=args.delay,
+            previous_file_name=args.previous,
+            feed_format=args.format,
+        )
+    except CacheMissError as error:
+        parser.error(str(error))
 
 
 if __name__ == "__main__":
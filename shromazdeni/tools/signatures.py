@@ -1,5 +1,4 @@
 import argparse
-import json
 import locale
 import sys
 from typing import List
@@ -17,11 +16,30 @@ def main(argv: List[str]) -> None:
         type=argparse.FileType("rb"),
         help="the json file with flats definition",
     )
+    parser.add_argument(
+        "--no-cache",
+        action="store_true",
+        help="don't use or create the converted flats cache next to the json file",
+    )
+    parser.add_argument(
+        "--page-rows",
+        metavar="N",
+        type=int,
+        default=reports.PAGE_ROWS,
+        help="rows in one printed table with a subtotal (0 for one table)",
+    )
+    parser.add_argument(
+        "--jobs",
+        metavar="N",
+        type=int,
+        default=1,
+        help="render rows of a large building in N processes",
+    )
 
     args = parser.parse_args(argv)
-    flats = utils.from_json_to_flats(json.load(args.flats))
+    flats = utils.load_flats(args.flats, not args.no_cache)
     building = business.Building(flats=flats)
-    reports.write_signatures(building, "signatures.html")
+    reports.write_signatures(building, "signatures.html", args.page_rows, args.jobs)
 
 
 if __name__ == "__main__":
@@ -64,8 +64,13 @@ def main(argv: List[str]) -> None:
         type=argparse.FileType("w"),
         help="the output file with flats definition",
     )
+    parser.add_argument(
+        "--no-cache",
+        action="store_true",
+        help="don't use or create the converted flats cache next to the json file",
+    )
     args = parser.parse_args(argv)
-    flats = utils.from_json_to_flats(json.load(args.input_flats))
+    flats = utils.load_flats(args.input_flats, not args.no_cache)
     validate_flat_names(parser, flats, args.flat)
 
     transformed_flats = split_flats(flats, args.flat)
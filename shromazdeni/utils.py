@@ -1,12 +1,73 @@
+import codecs
 import fractions
+import functools
+import json
+import os
+import pickle
+import sys
 from shromazdeni import business
-from typing import Dict, List, Any
+from typing import (
+    Any,
+    Callable,
+    cast,
+    Dict,
+    IO,
+    Iterable,
+    Iterator,
+    List,
+    Optional,
+    Tuple,
+    TypeVar,
+)
+
+# Increase when the cached form of flats changes.
+CACHE_VERSION = 1
+# Size of chunks read by the streaming json reader.
+READ_CHUNK_SIZE = 64 * 1024
+# Number of distinct owner names remembered by memoized name parsers.
+NAME_CACHE_SIZE = 4096
+
+F = TypeVar("F", bound=Callable[..., Any])
+_name_caches: Dict[str, Any] = {}
+
+
+def memoize_name(func: F) -> F:
+    """Remembers results of an owner name parser in a bounded LRU cache.
+
+    The same owners (e.g. SJM couples) usually own a flat, a cellar and
+    a garage spot, so most names are parsed repeatedly.
+    Results must be immutable as they are shared between calls.
+    """
+    cached = functools.lru_cache(maxsize=NAME_CACHE_SIZE)(func)
+    _name_caches[f"{func.__module__}.{func.__qualname__}"] = cached
+    return cast(F, cached)
+
+
+def name_cache_stats() -> Dict[str, Dict[str, float]]:
+    """Returns hits, misses and hit rate of every memoized name parser."""
+    stats = {}
+    for name, cached in _name_caches.items():
+        info = cached.cache_info()
+        calls = info.hits + info.misses
+        stats[name] = {
+            "hits": info.hits,
+            "misses": info.misses,
+            "size": info.currsize,
+            "hit_rate": info.hits / calls if calls else 0.0,
+        }
+    return stats
+
+
+@functools.lru_cache(maxsize=1024)
+def _parse_fraction(text: str) -> fractions.Fraction:
+    # Fractions are immutable, so owners with the same share can share one.
+    return fractions.Fraction(text)
 
 
 def _convert_flat(flat: Dict, shorten_name: bool) -> business.Flat:
-    name = flat["name"]
+    name = sys.intern(flat["name"])
     if shorten_name:
-        shortname = name.split("/", 1)[1]
+        shortname = sys.intern(name.split("/", 1)[1])
     else:
         shortname = name
 
@@ -14,11 +75,13 @@ def _convert_flat(flat: Dict, shorten_name: bool) -> business.Flat:
     for json_owner in flat["owners"]:
         owners.append(
             business.Owner(
-                name=json_owner["name"],
-                fraction=fractions.Fraction(json_owner["fraction"]),
+                name=sys.intern(json_owner["name"]),
+                fraction=_parse_fraction(json_owner["fraction"]),
             )
         )
-    persons = set(person for owner in owners for person in format_persons(owner.name))
+    persons = set(
+        sys.intern(person) for owner in owners for person in format_persons(owner.name)
+    )
     return business.Flat(
         name=shortname,
         original_name=name,
@@ -28,14 +91,177 @@ def _convert_flat(flat: Dict, shorten_name: bool) -> business.Flat:
     )
 
 
-def from_json_to_flats(json_flats: List) -> List[business.Flat]:
-    prefixes = set(flat["name"].split("/")[0] for flat in json_flats)
-    shorten_name = len(prefixes) == 1
-    flats = [_convert_flat(flat, shorten_name) for flat in json_flats]
+def from_json_to_flats(json_flats: Iterable[Dict]) -> List[business.Flat]:
+    """Converts json flats in a single pass so they can come from a stream."""
+    prefixes = set()
+    flats = []
+    for json_flat in json_flats:
+        prefixes.add(json_flat["name"].split("/")[0])
+        flats.append(_convert_flat(json_flat, shorten_name=False))
+    if len(prefixes) == 1:
+        # All flats are in the same building, the building number is redundant.
+        for flat in flats:
+            flat.name = sys.intern(flat.original_name.split("/", 1)[1])
     flats.sort(key=lambda flat: flat.sort_key)
     return flats
 
 
+def iter_json_flats(fin: IO) -> Iterator[Dict]:
+    """Reads flats one by one from a json array or from JSON Lines.
+
+    The file is read in chunks, so the whole document is never in memory.
+    """
+    decoder = json.JSONDecoder()
+    chunks = _read_text_chunks(fin)
+    buffer = ""
+    pos = 0
+
+    def fill() -> bool:
+        nonlocal buffer, pos
+        chunk = next(chunks, None)
+        if chunk is None:
+            return False
+        buffer = buffer[pos:] + chunk
+        pos = 0
+        return True
+
+    def skip(chars: str) -> bool:
+        """Skips whitespace and the chars, returns False at the end of data."""
+        nonlocal pos
+        while True:
+            while pos < len(buffer) and (buffer[pos].isspace() or buffer[pos] in chars):
+                pos += 1
+            if pos < len(buffer) or not fill():
+                return pos < len(buffer)
+
+    if not skip(""):
+        return
+    in_array = buffer[pos] == "["
+    if in_array:
+        pos += 1
+    while skip(","):
+        if in_array and buffer[pos] == "]":
+            return
+        while True:
+            try:
+                value, end = decoder.raw_decode(buffer, pos)
+            except json.JSONDecodeError:
+                # The value may continue in the next chunk.
+                if not fill():
+                    raise
+                continue
+            if end == len(buffer) and fill():
+                # A number could be cut at the chunk boundary.
+                continue
+            break
+        pos = end
+        yield value
+
+
+def _read_text_chunks(fin: IO) -> Iterator[str]:
+    decoder = codecs.getincrementaldecoder("utf-8")()
+    while True:
+        chunk = fin.read(READ_CHUNK_SIZE)
+        if not chunk:
+            break
+        if isinstance(chunk, bytes):
+            chunk = decoder.decode(chunk)
+        yield chunk
+    tail = decoder.decode(b"", final=True)
+    if tail:
+        yield tail
+
+
+def load_flats(fin: IO, use_cache: bool = True) -> List[business.Flat]:
+    """Loads flats from the json file.
+
+    Converted flats are stored in a sidecar cache file which is used instead
+    of the json while the json file keeps its path, mtime and size.
+    """
+    key = _cache_key(fin) if use_cache else None
+    # The key holds the path, streams like stdin have none.
+    cache_filename = f"{key[1]}.cache" if key else ""
+    if key:
+        flats = _read_cache(cache_filename, key)
+        if flats is not None:
+            return flats
+    flats = from_json_to_flats(iter_json_flats(fin))
+    if key:
+        _write_cache(cache_filename, key, flats)
+    return flats
+
+
+def _cache_key(fin: IO) -> Optional[Tuple]:
+    try:
+        stat = os.fstat(fin.fileno())
+    except (AttributeError, OSError, ValueError):
+        return None
+    name = getattr(fin, "name", None)
+    if not isinstance(name, str) or not os.path.isfile(name):
+        return None
+    return (CACHE_VERSION, os.path.abspath(name), stat.st_mtime_ns, stat.st_size)
+
+
+def _read_cache(filename: str, key: Tuple) -> Optional[List[business.Flat]]:
+    try:
+        with open(filename, "rb") as fin:
+            cached_key, flat_tuples = pickle.load(fin)
+    except (OSError, EOFError, pickle.UnpicklingError, ValueError, TypeError):
+        return None
+    if cached_key != key:
+        return None
+    owner_fractions: Dict[Tuple[int, int], fractions.Fraction] = {}
+
+    def owner_fraction(numerator: int, denominator: int) -> fractions.Fraction:
+        pair = (numerator, denominator)
+        if pair not in owner_fractions:
+            owner_fractions[pair] = fractions.Fraction(numerator, denominator)
+        return owner_fractions[pair]
+
+    # Interned like in _convert_flat, so buildings loaded into one process
+    # share owner names.
+    intern = sys.intern
+    return [
+        business.Flat(
+            name=intern(name),
+            original_name=intern(original_name),
+            fraction=fractions.Fraction(numerator, denominator),
+            owners=[
+                business.Owner(intern(owner_name), owner_fraction(o_numerator, o_denom))
+                for owner_name, o_numerator, o_denom in owners
+            ],
+            persons=set(map(intern, persons)),
+        )
+        for name, original_name, numerator, denominator, owners, persons in flat_tuples
+    ]
+
+
+def _write_cache(filename: str, key: Tuple, flats: List[business.Flat]) -> None:
+    # Only primitive tuples are stored so loading skips dataclass pickling.
+    flat_tuples = [
+        (
+            flat.name,
+            flat.original_name,
+            flat.fraction.numerator,
+            flat.fraction.denominator,
+            tuple(
+                (owner.name, owner.fraction.numerator, owner.fraction.denominator)
+                for owner in flat.owners
+            ),
+            tuple(flat.persons),
+        )
+        for flat in flats
+    ]
+    tmp_filename = f"{filename}.tmp"
+    try:
+        with open(tmp_filename, "wb") as fout:
+            pickle.dump((key, flat_tuples), fout, pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp_filename, filename)
+    except OSError:
+        # The cache is only an optimization, e.g. the directory can be read-only.
+        pass
+
+
 def from_owners_to_json(owners: List[business.Owner]) -> List[Dict[str, Any]]:
     return [{"name": owner.name, "fraction": str(owner.fraction)} for owner in owners]
 
@@ -52,11 +278,16 @@ def from_flats_to_json(flats: List[business.Flat]) -> List[Dict[str, Any]]:
 
 
 def format_persons(name: str) -> List[str]:
+    return list(_split_persons(name))
+
+
+@memoize_name
+def _split_persons(name: str) -> Tuple[str, ...]:
     if name.startswith("SJM"):
         name = name[3:].strip()
         names, address = name.split(",", 1)
         address = address.strip()
         name1, name2 = names.split(" a ")
-        return [", ".join((name1, address)), ", ".join((name2, address))]
+        return (", ".join((name1, address)), ", ".join((name2, address)))
     else:
-        return [name]
+        return (name,)
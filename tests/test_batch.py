@@ -0,0 +1,87 @@
+import fractions
+import io
+
+import pytest
+
+from shromazdeni import batch
+from shromazdeni import business
+
+
+@pytest.fixture
+def building() -> business.Building:
+    third = fractions.Fraction(1) / 3
+    return business.Building(
+        [
+            business.Flat(
+                name=name,
+                original_name=name,
+                fraction=third,
+                owners=[business.Owner("Petr Novák")],
+                persons={"Petr Novák"},
+            )
+            for name in ["1", "2", "3"]
+        ]
+    )
+
+
+def test_run_batch(building: business.Building) -> None:
+    script = io.StringIO(
+        "# pre-registration\n"
+        "add,Petr Novák,1,2\n"
+        "\n"
+        "add,Jana Nová,3\n"
+        "add,Petr Novák,2\n"
+        "remove,3\n"
+        "remove,Petr Novák\n"
+        "add,Jana Nová,1\n"
+    )
+
+    summary = batch.run_batch(building, script)
+
+    assert summary.operations == 6
+    assert summary.errors == []
+    assert building.dump_state()["flats"] == {"1": "Jana Nová"}
+    assert building.percent_represented == fractions.Fraction(100, 3)
+
+
+def test_run_batch_errors(building: business.Building) -> None:
+    script = io.StringIO(
+        "add,Petr Novák,1\n"
+        "add,Jana Nová,2,1\n"
+        "add,Jana Nová,10\n"
+        "add,Jana Nová\n"
+        "remove,2\n"
+        "remove,Nikdo\n"
+        "vote,1\n"
+    )
+
+    summary = batch.run_batch(building, script)
+
+    assert summary.operations == 1
+    assert summary.errors == [
+        "line 2: 1 is already represented by Petr Novák",
+        'line 3: unit "10" not found',
+        'line 4: use "add,<person>,<flat>[,<flat>...]"',
+        'line 5: "2" is not represented',
+        'line 6: "Nikdo" is neither flat or person',
+        'line 7: unknown operation "vote"',
+    ]
+    assert building.dump_state()["flats"] == {"1": "Petr Novák"}
+    assert not building.person_exists("Jana Nová")
+
+
+def test_write_summary(building: business.Building) -> None:
+    out = io.StringIO()
+    summary = batch.BatchSummary(operations=2, errors=["line 1: bad"], elapsed=0.5)
+
+    batch.write_summary(summary, building, out)
+
+    assert out.getvalue() == (
+        "line 1: bad\n"
+        "Applied 2 operations, 1 failed in 0.500 s (4 ops/s).\n"
+        "Represented 0.0%.\n"
+    )
+
+
+if __name__ == "__main__":
+    pytest.main()
@@ -0,0 +1,362 @@
+import io
+import json
+import pathlib
+from typing import Any, Dict, List
+from unittest import mock
+
+import pytest
+
+pytest.importorskip("scrapy")
+
+from shromazdeni.tools import crawler  # noqa: E402
+
+
+def test_crawler_settings_replay(tmp_path: pathlib.Path) -> None:
+    settings = crawler.crawler_settings("flats.json", str(tmp_path), replay=True)
+    assert settings["HTTPCACHE_ENABLED"]
+    assert settings["HTTPCACHE_DIR"] == str(tmp_path)
+    assert settings["HTTPCACHE_IGNORE_MISSING"]
+    assert "HTTPCACHE_ENABLED" not in crawler.crawler_settings("flats.json")
+
+
+def test_crawler_settings_refresh(tmp_path: pathlib.Path) -> None:
+    settings = crawler.crawler_settings("flats.json", str(tmp_path), refresh=True)
+    policy = settings["HTTPCACHE_POLICY"](settings)
+    assert not policy.is_cached_response_fresh(None, None)
+    assert not policy.is_cached_response_valid(None, None, None)
+    # Replay compares the cached pages.
+    settings = crawler.crawler_settings(
+        "flats.json", str(tmp_path), replay=True, refresh=True
+    )
+    assert settings["HTTPCACHE_POLICY"] != crawler.RefreshPolicy
+
+
+def test_crawler_settings_json_lines() -> None:
+    assert crawler.output_format("flats.json") == "json"
+    assert crawler.output_format("flats.jsonl") == "jsonl"
+    assert crawler.output_format("-") == "jsonl"
+    settings = crawler.crawler_settings("-", feed_format="jsonl")
+    assert settings["FEED_URI"] == "stdout:"
+    assert settings["FEED_FORMAT"] == "jsonlines"
+
+
+def test_find_region_is_cached(tmp_path: pathlib.Path) -> None:
+    response = mock.Mock(data=json.dumps({"suggestions": ["Praha (Praha)"]}))
+    with mock.patch("urllib3.PoolManager") as pool:
+        pool.return_value.request.return_value = response
+        assert crawler.find_region("Praha", cache_dir=str(tmp_path)) == "Praha (Praha)"
+        pool.assert_called_once()
+
+        region = crawler.find_region("Praha", cache_dir=str(tmp_path), replay=True)
+        assert region == "Praha (Praha)"
+        pool.assert_called_once()
+
+
+def test_download_building_previous_refreshes_cache(
+    tmp_path: pathlib.Path, capsys: pytest.CaptureFixture
+) -> None:
+    regions = {"Praha": ["Praha (Praha)"]}
+    (tmp_path / crawler.REGIONS_FILENAME).write_text(json.dumps(regions))
+    unit = {"name": "777/1", "fraction": "1/2", "owners": []}
+    previous = tmp_path / "previous.json"
+    previous.write_text(json.dumps([unit]))
+    output = tmp_path / "flats.json"
+    # Written by the mocked crawl.
+    output.write_text(json.dumps([unit, dict(unit, name="777/2")]))
+
+    with mock.patch.object(crawler, "CrawlerProcess") as process:
+        crawler.download_building(
+            str(output),
+            street="Národní",
+            home_number="55",
+            region="Praha",
+            cache_dir=str(tmp_path),
+            previous_file_name=str(previous),
+        )
+
+    settings = process.call_args[1]["settings"]
+    assert settings["HTTPCACHE_POLICY"] is crawler.RefreshPolicy
+    assert "Added units: 777/2" in capsys.readouterr().out
+
+
+def test_find_region_replay_miss(tmp_path: pathlib.Path) -> None:
+    with pytest.raises(crawler.CacheMissError):
+        crawler.find_region("Brno", cache_dir=str(tmp_path), replay=True)
+
+
+def test_download_building_replay_miss(tmp_path: pathlib.Path) -> None:
+    regions = {"Praha": ["Praha (Praha)"]}
+    (tmp_path / crawler.REGIONS_FILENAME).write_text(json.dumps(regions))
+
+    with mock.patch.object(crawler, "CrawlerProcess") as process:
+        stats = process.return_value.create_crawler.return_value.stats
+        stats.get_value.return_value = 3
+        with pytest.raises(crawler.CacheMissError, match="3 requests"):
+            crawler.download_building(
+                str(tmp_path / "flats.json"),
+                street="Národní",
+                home_number="55",
+                region="Praha",
+                cache_dir=str(tmp_path),
+                replay=True,
+            )
+
+    stats.get_value.assert_called_once_with("httpcache/miss", 0)
+
+
+def test_spider_base_url() -> None:
+    spider = crawler.KatastrSpider(
+        "Praha", "Národní", "55", base_url="http://localhost:8000", download_delay=0
+    )
+    assert spider.start_urls == ["http://localhost:8000/VyberBudovu.aspx?typ=Jednotka"]
+    assert spider.allowed_domains == ["localhost"]
+
+
+LISTING = """
+<html><body>
+<table summary="Nalezené jednotky">
+<tr><th>Číslo jednotky</th><th>Způsob využití</th></tr>
+<tr><td><a href="Jednotka.aspx?id=1">777/1</a></td><td>byt</td></tr>
+<tr><td><a href="Jednotka.aspx?id=2">777/2</a></td><td>byt</td></tr>
+</table>
+</body></html>
+"""
+
+
+def test_parse_building_downloads_every_unit() -> None:
+    from scrapy.http import HtmlResponse
+
+    response = HtmlResponse(
+        "https://nahlizenidokn.cuzk.cz/VyberBudovu.aspx",
+        body=LISTING.encode(),
+        encoding="utf-8",
+    )
+    spider = crawler.KatastrSpider("Praha", "Národní", "55")
+
+    results = list(spider.parse_building(response))
+
+    assert [request.url for request in results] == [
+        "https://nahlizenidokn.cuzk.cz/Jednotka.aspx?id=1",
+        "https://nahlizenidokn.cuzk.cz/Jednotka.aspx?id=2",
+    ]
+
+
+UNIT = """
+<html><body>
+<table summary="Atributy jednotky">
+<tr><td>Číslo jednotky:</td><td><strong>777/1</strong></td></tr>
+<tr><td>Podíl na společných částech:</td><td>1/2</td></tr>
+</table>
+<table class="vlastnici">
+<tr><th>Vlastnické právo</th><th class="right">Podíl</th></tr>
+<tr><td>{owner}</td><td class="right">1</td></tr>
+</table>
+</body></html>
+"""
+
+
+def test_sold_unit_is_changed() -> None:
+    from scrapy.http import HtmlResponse
+
+    spider = crawler.KatastrSpider("Praha", "Národní", "55")
+
+    def parse_unit(owner: str) -> Dict:
+        response = HtmlResponse(
+            "https://nahlizenidokn.cuzk.cz/Jednotka.aspx?id=1",
+            body=UNIT.format(owner=owner).encode(),
+            encoding="utf-8",
+        )
+        units: List[Dict] = list(spider.parse_flat(response))
+        return units[0]
+
+    # The row in the list of units stays the same, only the owner changes.
+    previous = parse_unit("Novák Petr")
+    current = parse_unit("Dvořák Karel")
+
+    assert current["owners"] == [{"name": "Dvořák Karel", "fraction": "1"}]
+    assert crawler.compare_crawls([previous], [current]) == crawler.Changes(
+        added=[], removed=[], changed=["777/1"], unchanged=0
+    )
+
+
+OWNERS = """
+<html><body>
+<table class="vlastnici other-table" summary="Vlastníci, jiní oprávnění">
+<tr><th>Vlastnické právo</th><th class="right">Podíl</th></tr>
+<tr><td>Novák Petr, Národní 55, Praha</td><td class="right">1/2</td></tr>
+<tr><td>SJM Novák Jan a Nováková Eva</td><td class="right">1/2</td></tr>
+<tr><td class="partnerSJM"><i>Novák Jan</i>, Národní 55, Praha</td><td></td></tr>
+<tr><td class="partnerSJM"><i>Nováková Eva</i>, Národní 55, Praha</td><td></td></tr>
+<tr><th>Jiný oprávněný</th></tr>
+<tr><td>Banka a.s.</td><td class="right">1</td></tr>
+</table>
+</body></html>
+"""
+
+SINGLE_OWNER = """
+<html><body>
+<table class="vlastnici">
+<tr><th>Vlastnické právo</th></tr>
+<tr><td><!-- poznámka -->Obec Praha<br>Mariánské nám. 2</td><td></td></tr>
+<tr><td>SJM Dvořák Karel a Dvořáková Jana</td><td class="right">2/3</td></tr>
+<tr class="partnerSJM"><td><i>Dvořák Karel</i></td></tr>
+</table>
+</body></html>
+"""
+
+
+@pytest.mark.parametrize(
+    "html, owners",
+    [
+        (
+            OWNERS,
+            [
+                {"name": "Novák Petr, Národní 55, Praha", "fraction": "1/2"},
+                {
+                    "name": "SJM Novák Jan a Nováková Eva",
+                    "fraction": "1/2",
+                    "person1": "Novák Jan",
+                    "person2": "Nováková Eva",
+                },
+            ],
+        ),
+        (
+            SINGLE_OWNER,
+            [
+                {"name": "Obec Praha", "fraction": "1"},
+                {
+                    "name": "SJM Dvořák Karel a Dvořáková Jana",
+                    "fraction": "2/3",
+                    "person1": "Dvořák Karel",
+                },
+            ],
+        ),
+        ("<html><body><p>Jednotka nemá vlastníky.</p></body></html>", []),
+    ],
+)
+def test_parse_owners(html: str, owners: List[Dict]) -> None:
+    from scrapy.http import HtmlResponse
+
+    response = HtmlResponse(
+        "https://nahlizenidokn.cuzk.cz/Jednotka.aspx",
+        body=html.encode(),
+        encoding="utf-8",
+    )
+    assert crawler.parse_owners(response) == owners
+
+
+def test_compare_crawls() -> None:
+    unit = {"name": "777/1", "fraction": "1/2", "owners": []}
+    previous = [unit, {"name": "777/2", "fraction": "1/2", "owners": []}]
+    current: List[Dict] = [
+        unit,
+        {"name": "777/2", "fraction": "1/2", "owners": [{"name": "Petr"}]},
+        {"name": "777/3", "fraction": "1/2", "owners": []},
+    ]
+    changes = crawler.compare_crawls(previous, current)
+    assert changes == crawler.Changes(
+        added=["777/3"], removed=[], changed=["777/2"], unchanged=1
+    )
+
+
+def test_read_addresses() -> None:
+    fin = io.StringIO(
+        "# region,street,home_number\nPraha,Národní,55\n\nBrno, Údolní ,1\n"
+    )
+    addresses = crawler.read_addresses(fin)
+    assert addresses == [
+        crawler.Address("Praha", "Národní", "55"),
+        crawler.Address("Brno", "Údolní", "1"),
+    ]
+    assert addresses[0].slug == "Praha-Národní-55"
+    with pytest.raises(ValueError):
+        crawler.read_addresses(io.StringIO("Praha,Národní\n"))
+
+
+def test_batch_settings_throttle() -> None:
+    settings = crawler.batch_settings(
+        None, replay=False, download_delay=2.0, parallel=3
+    )
+    assert settings["AUTOTHROTTLE_ENABLED"]
+    # Three crawls at once wait three times longer than a single one.
+    assert settings["AUTOTHROTTLE_START_DELAY"] == 6.0
+    assert settings["CONCURRENT_REQUESTS_PER_DOMAIN"] == 1
+    assert "AUTOTHROTTLE_ENABLED" not in crawler.batch_settings(
+        "cache", replay=True, download_delay=2.0
+    )
+
+
+def test_download_buildings_resumes(tmp_path: pathlib.Path) -> None:
+    done = crawler.Address("Praha", "Národní", "55")
+    (tmp_path / f"{done.slug}.json").write_text("[]")
+    missing = crawler.Address("Brno", "Údolní", "1")
+
+    with mock.patch.object(crawler, "CrawlerProcess") as process:
+        errors = crawler.download_buildings([done, missing], str(tmp_path), replay=True)
+
+    # The finished building is skipped, the other one has no cached region.
+    assert errors == ['Brno-Údolní-1: region "Brno" is not in the cache']
+    process.return_value.start.assert_not_called()
+
+
+def test_download_buildings_restarts_unfinished(tmp_path: pathlib.Path) -> None:
+    address = crawler.Address("Praha", "Národní", "55")
+    part = tmp_path / f"{address.slug}.json.part"
+    part.write_text('[{"name": "777/1"')
+    regions = {"Praha": ["Praha (Praha)"]}
+    (tmp_path / crawler.REGIONS_FILENAME).write_text(json.dumps(regions))
+    exists_at_crawl = []
+
+    with mock.patch.object(crawler, "CrawlerProcess") as process, mock.patch.object(
+        crawler, "Crawler"
+    ) as crawler_class, mock.patch("twisted.internet.reactor.stop"):
+        crawler_class.return_value.stats.get_value.return_value = 0
+        process.return_value.crawl.side_effect = lambda *args, **kwargs: (
+            exists_at_crawl.append(part.exists())
+        )
+        crawler.download_buildings(
+            [address], str(tmp_path), cache_dir=str(tmp_path), replay=True
+        )
+
+    assert exists_at_crawl == [False]
+
+
+def test_download_buildings_reports_failed_crawl(tmp_path: pathlib.Path) -> None:
+    failing = crawler.Address("Praha", "Národní", "55")
+    address = crawler.Address("Praha", "Národní", "57")
+    regions = {"Praha": ["Praha (Praha)"]}
+    (tmp_path / crawler.REGIONS_FILENAME).write_text(json.dumps(regions))
+    stats = {"finish_reason": "finished"}
+
+    def crawl(crawler_: Any, **kwargs: str) -> None:
+        if kwargs["home_number"] == failing.home_number:
+            raise RuntimeError("spider failed to open")
+        (tmp_path / f"{address.slug}.json.part").write_text("[]")
+
+    with mock.patch.object(crawler, "CrawlerProcess") as process, mock.patch.object(
+        crawler, "Crawler"
+    ) as crawler_class, mock.patch("twisted.internet.reactor.stop"):
+        crawler_class.return_value.stats.get_value.side_effect = stats.get
+        process.return_value.crawl.side_effect = crawl
+        errors = crawler.download_buildings(
+            [failing, address], str(tmp_path), cache_dir=str(tmp_path), replay=True
+        )
+
+    assert errors == [
+        f"{failing.slug}: crawl failed: RuntimeError('spider failed to open')"
+    ]
+    assert (tmp_path / f"{address.slug}.json").exists()
+    assert not (tmp_path / f"{failing.slug}.json").exists()
+
+
+def test_download_buildings_resumes_json_lines(tmp_path: pathlib.Path) -> None:
+    done = crawler.Address("Praha", "Národní", "55")
+    (tmp_path / f"{done.slug}.jsonl").write_text("")
+
+    with mock.patch.object(crawler, "CrawlerProcess") as process:
+        errors = crawler.download_buildings(
+            [done], str(tmp_path), replay=True, feed_format="jsonl"
+        )
+
+    assert errors == []
+    process.return_value.start.assert_not_called()
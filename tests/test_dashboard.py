@@ -0,0 +1,96 @@
+import fractions
+import json
+import urllib.request
+from typing import Any, Dict
+
+from shromazdeni import business
+from shromazdeni import dashboard
+
+
+def create_building() -> business.Building:
+    quarter = fractions.Fraction(1, 4)
+    return business.Building(
+        [
+            business.Flat(
+                name=str(i),
+                original_name=str(i),
+                fraction=quarter,
+                owners=[business.Owner(f"Owner {i}")],
+                persons={f"Owner {i}"},
+            )
+            for i in range(1, 5)
+        ]
+    )
+
+
+def decode(event: Any) -> Dict[str, Any]:
+    assert event.startswith(b"data: ") and event.endswith(b"\n\n")
+    data: Dict[str, Any] = json.loads(event.split(b" ", 1)[1])
+    return data
+
+
+def test_dashboard_events() -> None:
+    model = create_building()
+    board = dashboard.Dashboard(model, arrivals=2)
+    client = board.subscribe()
+    assert decode(client.get_nowait())["represented"] == 0
+
+    for i in range(1, 4):
+        model.add_person(f"Owner {i}")
+        model.represent_flat(str(i), f"Owner {i}")
+    # Only the latest event waits for a slow page.
+    event = decode(client.get_nowait())
+    assert client.empty()
+    assert event["percent"] == 75
+    assert event["quorum"]
+    assert (event["represented"], event["units"]) == (3, 4)
+    assert [arrival["name"] for arrival in event["arrivals"]] == [
+        "Owner 3",
+        "Owner 2",
+    ]
+
+    model.remove_person("Owner 3")
+    event = decode(client.get_nowait())
+    assert not event["quorum"]
+    assert [arrival["name"] for arrival in event["arrivals"]] == ["Owner 2"]
+
+    board.unsubscribe(client)
+    model.remove_person("Owner 2")
+    assert client.empty()
+
+
+def test_dashboard_load_state() -> None:
+    model = create_building()
+    model.add_person("Owner 1")
+    model.represent_flat("1", "Owner 1")
+    state = model.dump_state()
+    model = create_building()
+    board = dashboard.Dashboard(model)
+    client = board.subscribe()
+    client.get_nowait()
+
+    model.load_state(state)
+    event = decode(client.get_nowait())
+    assert event["percent"] == 25
+    assert [arrival["name"] for arrival in event["arrivals"]] == ["Owner 1"]
+
+
+def test_dashboard_server() -> None:
+    model = create_building()
+    server = dashboard.start(model, ("localhost", 0))
+    url = f"http://localhost:{server.server_address[1]}"
+    try:
+        with urllib.request.urlopen(url + "/") as response:
+            assert b"EventSource" in response.read()
+        with urllib.request.urlopen(url + "/events") as response:
+            assert response.headers["Content-Type"] == "text/event-stream"
+            event = decode(response.readline() + response.readline())
+            assert event["represented"] == 0
+            model.add_person("Owner 1")
+            model.represent_flat("1", "Owner 1")
+            while event["represented"] == 0:
+                event = decode(response.readline() + response.readline())
+            dashboard.stop(server)
+            assert response.read() == b""
+    finally:
+        server.server_close()
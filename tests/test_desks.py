@@ -0,0 +1,356 @@
+import asyncio
+import fractions
+import io
+import json
+import pathlib
+import queue
+import threading
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+import pytest
+from _pytest.monkeypatch import MonkeyPatch
+
+from shromazdeni import __main__
+from shromazdeni import business
+from shromazdeni import dashboard
+from shromazdeni import desks
+from shromazdeni import stats
+
+
+def create_flats() -> List[business.Flat]:
+    third = fractions.Fraction(1) / 3
+    return [
+        business.Flat(
+            name=name,
+            original_name=name,
+            fraction=third,
+            owners=[business.Owner("Petr Novák")],
+            persons={"Petr Novák"},
+        )
+        for name in ["1", "2", "3"]
+    ]
+
+
+@pytest.fixture
+def coordinator(
+    tmp_path: pathlib.Path,
+) -> Iterator[Tuple[business.Building, str]]:
+    model = business.Building(create_flats())
+    address = str(tmp_path / "desks.sock")
+    loop = asyncio.new_event_loop()
+    server = loop.run_until_complete(desks.Coordinator(model).start(address))
+    thread = threading.Thread(target=loop.run_forever, daemon=True)
+    thread.start()
+    yield model, address
+    loop.call_soon_threadsafe(loop.stop)
+    thread.join()
+    server.close()
+    loop.run_until_complete(server.wait_closed())
+    loop.close()
+
+
+def test_parse_address() -> None:
+    assert desks.parse_address("unix:/tmp/desks.sock") == "/tmp/desks.sock"
+    assert desks.parse_address("localhost:8000") == ("localhost", 8000)
+    assert desks.parse_address(":8000") == ("localhost", 8000)
+    with pytest.raises(ValueError):
+        desks.parse_address("localhost")
+
+
+def test_execute() -> None:
+    model = business.Building(create_flats())
+    request = {"id": 1, "op": "add_person", "args": ["Petr Novák"]}
+
+    response, events = desks.execute(model, request)
+    assert response == {"id": 1, "ok": True, "result": None}
+    assert [event["op"] for event in events] == ["add_person"]
+
+    response, events = desks.execute(model, request)
+    assert response["ok"] and events == []
+
+    response, events = desks.execute(
+        model, {"id": 2, "op": "represent_flat", "args": ["1", "Petr Novák"]}
+    )
+    assert events[0]["represented_share"] == 1
+
+
+def test_execute_add_representative() -> None:
+    model = business.Building(create_flats())
+    request = {"id": 1, "op": "add_representative", "args": ["Jana Nová", "1", "2"]}
+
+    response, events = desks.execute(model, request)
+
+    assert response == {"id": 1, "ok": True, "result": None}
+    assert [(event["op"], event["args"]) for event in events] == [
+        ("add_person", ["Jana Nová"]),
+        ("represent_flat", ["1", "Jana Nová"]),
+        ("represent_flat", ["2", "Jana Nová"]),
+    ]
+    assert model.get_representative_flats("Jana Nová") == ["1", "2"]
+
+
+@pytest.mark.parametrize(
+    "request_, error",
+    [
+        ({"id": 3, "op": "represent_flat", "args": ["1", "Jana Nová"]}, "conflict"),
+        (
+            {"id": 3, "op": "add_representative", "args": ["Eva Malá", "2", "1"]},
+            "conflict",
+        ),
+        (
+            {
+                "id": 3,
+                "op": "remove_flat_representative",
+                "args": ["1"],
+                "expect": None,
+            },
+            "conflict",
+        ),
+        (
+            {"id": 3, "op": "remove_person", "args": ["Petr Novák"], "expect": []},
+            "conflict",
+        ),
+        ({"id": 3, "op": "remove_person", "args": ["Nikdo"]}, "not_found"),
+        ({"id": 3, "op": "represent_flat", "args": ["10", "Petr Novák"]}, "not_found"),
+        ({"id": 3, "op": "represent_flat", "args": ["1"]}, "bad_request"),
+        ({"id": 3, "op": "flats", "args": []}, "bad_request"),
+        ({"id": 3, "op": "add_person", "args": [1]}, "bad_request"),
+    ],
+)
+def test_execute_errors(request_: dict, error: str) -> None:
+    model = business.Building(create_flats())
+    model.add_person("Petr Novák")
+    model.add_person("Jana Nová")
+    model.represent_flat("1", "Petr Novák")
+
+    state = model.dump_state()
+
+    response, events = desks.execute(model, request_)
+
+    assert response["error"] == error
+    assert events == []
+    assert model.dump_state() == state
+
+
+def test_desks_share_building(coordinator: Tuple[business.Building, str]) -> None:
+    model, address = coordinator
+    log = io.StringIO()
+    model.register_logger(__main__.CommandLogger(log))
+    desk1 = desks.RemoteBuilding(create_flats(), address)
+    desk2 = desks.RemoteBuilding(create_flats(), address)
+
+    desk1.add_person("Petr Novák")
+    desk1.represent_flat("1", "Petr Novák")
+    assert desk1.get_flat("1").represented
+
+    desk2.sync()
+    assert desk2.dump_state() == model.dump_state()
+    assert desk2.percent_represented == fractions.Fraction(100, 3)
+    desk2.add_person("Jana Nová")
+    with pytest.raises(business.ConflictError):
+        desk2.represent_flat("1", "Jana Nová")
+    with pytest.raises(KeyError):
+        desk2.remove_person("Nikdo")
+    assert desk2.remove_person("Petr Novák") == ["1"]
+
+    desk1.sync()
+    assert desk1.dump_state() == model.dump_state()
+    assert model.dump_state()["flats"] == {}
+    assert len(log.getvalue().splitlines()) == 4
+    desk1.close()
+    desk2.close()
+
+
+def test_desk_joins_running_gathering(
+    coordinator: Tuple[business.Building, str]
+) -> None:
+    model, address = coordinator
+    desk1 = desks.RemoteBuilding(create_flats(), address)
+    desk1.add_person("Petr Novák")
+    desk1.represent_flat("2", "Petr Novák")
+
+    desk2 = desks.RemoteBuilding(create_flats(), address)
+
+    assert desk2.get_representative_flats("Petr Novák") == ["2"]
+    desk1.close()
+    desk2.close()
+
+
+def test_desk_rejects_different_building(
+    coordinator: Tuple[business.Building, str]
+) -> None:
+    _model, address = coordinator
+
+    with pytest.raises(desks.ProtocolError):
+        desks.RemoteBuilding(create_flats()[:2], address)
+
+
+def test_desk_resyncs_during_request(
+    coordinator: Tuple[business.Building, str]
+) -> None:
+    model, address = coordinator
+    desk = desks.RemoteBuilding(create_flats(), address)
+    desk.add_person("Petr Novák")
+    # Changed by the coordinator without telling the desk.
+    model.add_person("Jana Nová")
+    model.represent_flat("3", "Jana Nová")
+    desk._socket.settimeout(5)
+
+    # The event of this change shows the divergence before the response comes.
+    desk.represent_flat("1", "Petr Novák")
+
+    assert desk.dump_state() == model.dump_state()
+    desk.close()
+
+
+def next_summary(client: "queue.Queue[Optional[bytes]]") -> Dict[str, Any]:
+    event = client.get(timeout=5)
+    assert event
+    summary: Dict[str, Any] = json.loads(event.split(b" ", 1)[1])
+    return summary
+
+
+def test_idle_desk_dashboard_follows(
+    coordinator: Tuple[business.Building, str]
+) -> None:
+    model, address = coordinator
+    idle_desk = desks.RemoteBuilding(create_flats(), address)
+    board = dashboard.Dashboard(idle_desk)
+    client = board.subscribe()
+    client.get_nowait()
+    idle_desk.follow()
+    desk = desks.RemoteBuilding(create_flats(), address)
+
+    desk.add_representative("Petr Novák", ["1"])
+
+    event = next_summary(client)
+    while event["represented"] == 0:
+        event = next_summary(client)
+    created_at = model.get_person("Petr Novák").created_at
+    assert event["arrivals"] == [
+        {"name": "Petr Novák", "time": created_at.strftime("%H:%M")}
+    ]
+    assert idle_desk.get_person("Petr Novák").created_at == created_at
+    desk.close()
+    idle_desk.close()
+
+
+def test_desk_listeners_see_coordinator_time(
+    coordinator: Tuple[business.Building, str]
+) -> None:
+    model, address = coordinator
+    desk = desks.RemoteBuilding(create_flats(), address)
+    seen = []
+
+    class Listener:
+        def changed(
+            self, changed: business.Building, func_name: str, args: Tuple
+        ) -> None:
+            if func_name == "add_person":
+                seen.append(changed.get_person(args[0]).created_at)
+
+    desk.register_listener(Listener())
+
+    desk.add_person("Petr Novák")
+
+    assert seen == [model.get_person("Petr Novák").created_at]
+    desk.close()
+
+
+def test_desk_latency_stats(
+    coordinator: Tuple[business.Building, str], monkeypatch: MonkeyPatch
+) -> None:
+    _model, address = coordinator
+    desk = desks.RemoteBuilding(create_flats(), address)
+    latency_stats = stats.LatencyStats()
+    desk.register_stats(latency_stats)
+    monkeypatch.setattr("shromazdeni.__main__.choice_from", lambda *args: 1)
+    monkeypatch.setattr("builtins.input", lambda q: "n")
+    cmd = __main__.AppCmd(desk, stdout=io.StringIO(), latency_stats=latency_stats)
+
+    cmd.onecmd(cmd.precmd("add 1"))
+    cmd.postcmd(False, "add 1")
+
+    recorded = latency_stats.as_dict()
+    assert recorded["command"]["add"]["count"] == 1
+    # Changes are applied to the replica when the coordinator confirms them.
+    assert set(recorded["building"]) == {"add_person", "represent_flat"}
+    desk.close()
+
+
+def test_console_reports_conflict(
+    coordinator: Tuple[business.Building, str], monkeypatch: MonkeyPatch
+) -> None:
+    model, address = coordinator
+    desk = desks.RemoteBuilding(create_flats(), address)
+    desk.add_person("Petr Novák")
+    # Changed by the coordinator without telling the desk.
+    model.add_person("Jana Nová")
+    model.represent_flat("3", "Jana Nová")
+    monkeypatch.setattr("shromazdeni.__main__.choice_from", lambda *args: 1)
+    out = io.StringIO()
+    cmd = __main__.AppCmd(desk, stdout=out)
+
+    cmd.onecmd("add 3")
+
+    assert out.getvalue().endswith("3 is already represented by Jana Nová\n")
+    assert desk.get_flat("3").represented == model.get_flat("3").represented
+    desk.close()
+
+
+def test_console_new_person_conflict(
+    coordinator: Tuple[business.Building, str], monkeypatch: MonkeyPatch
+) -> None:
+    model, address = coordinator
+    desk = desks.RemoteBuilding(create_flats(), address)
+    # Changed by the coordinator without telling the desk.
+    model.add_person("Jana Nová")
+    model.represent_flat("3", "Jana Nová")
+    monkeypatch.setattr("shromazdeni.__main__.choice_from", lambda *args: 0)
+    answers = {"Name: ": "Eva Malá"}
+    monkeypatch.setattr("builtins.input", lambda q: answers.get(q, "y"))
+    out = io.StringIO()
+    cmd = __main__.AppCmd(desk, stdout=out)
+
+    cmd.onecmd("add 1 3")
+
+    assert out.getvalue().endswith("3 is already represented by Jana Nová\n")
+    assert not model.person_exists("Eva Malá")
+    assert desk.dump_state() == model.dump_state()
+    desk.close()
+
+
+@pytest.mark.parametrize(
+    "command, message",
+    [
+        ("remove 1", "1 is now represented by Jana Nová\n"),
+        ("remove Petr Novák", "Petr Novák now represents 2, 3\n"),
+    ],
+)
+def test_console_stale_remove_conflicts(
+    coordinator: Tuple[business.Building, str], command: str, message: str
+) -> None:
+    model, address = coordinator
+    desk = desks.RemoteBuilding(create_flats(), address)
+    desk.add_person("Petr Novák")
+    desk.represent_flat("1", "Petr Novák")
+    desk.represent_flat("2", "Petr Novák")
+    # Changed by the coordinator without telling the desk.
+    model.remove_flat_representative("1")
+    model.add_person("Jana Nová")
+    model.represent_flat("1", "Jana Nová")
+    model.represent_flat("3", "Petr Novák")
+    out = io.StringIO()
+    cmd = __main__.AppCmd(desk, stdout=out)
+
+    cmd.onecmd(command)
+
+    assert out.getvalue() == message
+    assert model.get_representative_flats("Petr Novák") == ["2", "3"]
+    assert model.get_representative_flats("Jana Nová") == ["1"]
+    assert desk.dump_state() == model.dump_state()
+    desk.close()
+
+
+if __name__ == "__main__":
+    pytest.main()
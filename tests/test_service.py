@@ -0,0 +1,113 @@
+import asyncio
+import json
+import pathlib
+import socket
+import threading
+from typing import Any, Dict, Iterator, Tuple
+
+import pytest
+
+from shromazdeni import desks
+from shromazdeni import service
+from shromazdeni import utils
+
+JSON_FLATS = [
+    {"name": "1", "fraction": "1/2", "owners": [{"name": "P1", "fraction": "1"}]},
+    {"name": "2", "fraction": "1/2", "owners": [{"name": "P2", "fraction": "1"}]},
+]
+
+
+def write_config(tmp_path: pathlib.Path) -> pathlib.Path:
+    config = {}
+    for name in ["a", "b"]:
+        (tmp_path / f"{name}.json").write_text(json.dumps(JSON_FLATS))
+        config[name] = {"flats": f"{name}.json", "log": f"{name}.log"}
+    path = tmp_path / "config.json"
+    path.write_text(json.dumps(config))
+    return path
+
+
+@pytest.fixture
+def running_service(
+    tmp_path: pathlib.Path,
+) -> Iterator[Tuple[service.GatheringService, str]]:
+    gatherings = service.GatheringService.from_config(str(write_config(tmp_path)))
+    address = str(tmp_path / "service.sock")
+    loop = asyncio.new_event_loop()
+    server = loop.run_until_complete(gatherings.start(address))
+    thread = threading.Thread(target=loop.run_forever, daemon=True)
+    thread.start()
+    yield gatherings, address
+    loop.call_soon_threadsafe(loop.stop)
+    thread.join()
+    server.close()
+    loop.run_until_complete(server.wait_closed())
+    loop.close()
+    gatherings.close()
+
+
+def ask(address: str, request: Dict[str, Any]) -> Dict[str, Any]:
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+        sock.connect(address)
+        sock.sendall(desks.encode(request))
+        response: Dict[str, Any] = json.loads(sock.makefile().readline())
+    return response
+
+
+def test_read_config(tmp_path: pathlib.Path) -> None:
+    config = service.read_config(str(write_config(tmp_path)))
+    assert config["a"] == {
+        "flats": str(tmp_path / "a.json"),
+        "log": str(tmp_path / "a.log"),
+    }
+    (tmp_path / "config.json").write_text('{"a": {"log": "a.log"}}')
+    with pytest.raises(service.ConfigError):
+        service.read_config(str(tmp_path / "config.json"))
+
+
+def test_gatherings_are_separate(
+    running_service: Tuple[service.GatheringService, str]
+) -> None:
+    gatherings, address = running_service
+    flats = utils.from_json_to_flats(JSON_FLATS)
+    desk_a = desks.RemoteBuilding(flats, address, "a")
+    desk_b = desks.RemoteBuilding(utils.from_json_to_flats(JSON_FLATS), address, "b")
+    try:
+        desk_a.add_person("P1")
+        desk_a.represent_flat("1", "P1")
+        desk_b.sync()
+        assert desk_a.percent_represented == 50
+        assert desk_b.percent_represented == 0
+        assert gatherings.gatherings["a"].model.percent_represented == 50
+        assert gatherings.gatherings["b"].model.percent_represented == 0
+    finally:
+        desk_a.close()
+        desk_b.close()
+    response = ask(address, {"id": 1, "op": "gatherings"})
+    assert [row["percent_represented"] for row in response["result"]] == [50.0, 0.0]
+
+
+def test_unknown_gathering(
+    running_service: Tuple[service.GatheringService, str]
+) -> None:
+    _gatherings, address = running_service
+    with pytest.raises(desks.ProtocolError, match="unknown gathering"):
+        desks.RemoteBuilding(utils.from_json_to_flats(JSON_FLATS), address, "c")
+    response = ask(address, {"id": 1, "op": "add_person", "args": ["P1"]})
+    assert response["error"] == "bad_request"
+
+
+def test_log_replayed_on_restart(tmp_path: pathlib.Path) -> None:
+    config = str(write_config(tmp_path))
+    gatherings = service.GatheringService.from_config(config)
+    model = gatherings.gatherings["b"].model
+    model.add_person("P2")
+    model.represent_flat("2", "P2")
+    gatherings.close()
+
+    gatherings = service.GatheringService.from_config(config)
+    try:
+        assert gatherings.gatherings["a"].model.percent_represented == 0
+        assert gatherings.gatherings["b"].model.percent_represented == 50
+    finally:
+        gatherings.close()
@@ -1,6 +1,7 @@
 import fractions
 import io
 import pathlib
+import threading
 from datetime import datetime
 from unittest import mock
 
@@ -10,6 +11,10 @@ from _pytest.monkeypatch import MonkeyPatch
 
 from shromazdeni import __main__
 from shromazdeni import business
+from shromazdeni import reports
+from shromazdeni import stats
+from shromazdeni.reports import presence
+from shromazdeni.reports import utils as reports_utils
 
 
 @pytest.fixture
@@ -129,6 +134,28 @@ def test_complete_flat() -> None:
     assert possibilities == ["777/1", "777/2"]
 
 
+def test_complete_flat_with_segments() -> None:
+    model = business.Building(
+        [create_flat("1"), create_flat("1-01"), create_flat("1-02"), create_flat("2")]
+    )
+    cmd = __main__.AppCmd(model)
+
+    assert cmd.complete_flat("1-", "flat 1-", 7, 7) == ["1-01", "1-02"]
+    assert cmd.complete_flat("", "flat ", 5, 5) == ["1", "1-01", "1-02", "2"]
+
+
+def test_prefix_index() -> None:
+    index = business.PrefixIndex(["b", "ab", "a"])
+    index.add("abc")
+    index.add("ab")
+    index.remove("b")
+    index.remove("missing")
+
+    assert list(index) == ["a", "ab", "abc"]
+    assert index.startswith("ab") == ["ab", "abc"]
+    assert index.startswith("b") == []
+
+
 def test_add_without_param(simple_building: business.Building) -> None:
     out = io.StringIO()
     cmd = __main__.AppCmd(simple_building, stdout=out)
@@ -339,6 +366,189 @@ def test_remove_with_person(simple_building: business.Building) -> None:
     assert not simple_building.get_person_names("Radoslava Květná")
 
 
+def test_percent_represented(simple_building: business.Building) -> None:
+    assert simple_building.percent_represented == fractions.Fraction(100, 3)
+
+
+def test_percent_represented_follows_changes() -> None:
+    model = business.Building(
+        [create_flat("1"), create_flat("2"), create_flat("3")], self_check=True
+    )
+    model.add_person("Petr Novák")
+    model.add_person("Jana Nová")
+
+    model.represent_flat("1", "Petr Novák")
+    model.represent_flat("2", "Petr Novák")
+    model.represent_flat("2", "Jana Nová")
+    assert model.percent_represented == fractions.Fraction(200, 3)
+
+    model.remove_flat_representative("1")
+    model.remove_flat_representative("1")
+    assert model.percent_represented == fractions.Fraction(100, 3)
+
+    model.remove_person("Jana Nová")
+    assert model.percent_represented == 0
+
+
+def test_percent_represented_initially_represented() -> None:
+    person = business.Person("Radoslava Květná", datetime.min)
+    model = business.Building([create_flat("1", represented=person), create_flat("2")])
+
+    assert model.percent_represented == fractions.Fraction(100, 3)
+
+
+def test_integer_shares() -> None:
+    flats = [create_flat("1"), create_flat("2"), create_flat("3")]
+    flats[0].fraction = fractions.Fraction(1, 6)
+    flats[1].fraction = fractions.Fraction(1, 2)
+    model = business.Building(flats)
+    model.add_person("Petr Novák")
+    model.represent_flat("1", "Petr Novák")
+    model.represent_flat("2", "Petr Novák")
+
+    assert model.denominator == 6
+    assert [model.get_share(name) for name in "123"] == [1, 3, 2]
+    assert model.represented_share == 4
+    assert model.percent_represented == fractions.Fraction(200, 3)
+
+
+def test_representative_flats_index() -> None:
+    model = business.Building(
+        [create_flat("1"), create_flat("2"), create_flat("3")], self_check=True
+    )
+    model.add_person("Petr Novák")
+    model.add_person("Jana Nová")
+    model.represent_flat("3", "Petr Novák")
+    model.represent_flat("1", "Petr Novák")
+    model.represent_flat("2", "Jana Nová")
+
+    assert model.get_representative_flats("Petr Novák") == ["1", "3"]
+    assert model.get_represented_flats("") == ["1", "2", "3"]
+
+    model.represent_flat("3", "Jana Nová")
+    assert model.get_representative_flats("Jana Nová") == ["2", "3"]
+    assert model.remove_person("Petr Novák") == ["1"]
+    assert model.get_representative_flats("Petr Novák") == []
+    assert model.get_represented_flats("") == ["2", "3"]
+    model.check_consistency()
+
+
+def test_unrepresented_flats_index(
+    building_with_one_owner: business.Building,
+) -> None:
+    model = building_with_one_owner
+    model.add_person("Petr Novák")
+
+    assert model.get_other_representatives("Petr Novák") == ["1", "2"]
+    assert model.get_unrepresented_flats(["Jana Nová", "Nikdo"]) == ["2"]
+
+    model.represent_flat("2", "Petr Novák")
+    assert model.get_other_representatives("Petr Novák") == ["1"]
+    assert model.get_unrepresented_flats(["Jana Nová"]) == []
+
+    model.remove_person("Petr Novák")
+    assert model.get_unrepresented_flats(["Jana Nová", "Petr Novák"]) == ["1", "2"]
+    model.check_consistency()
+
+
+def test_presence_renders_only_changed_flats(
+    simple_building: business.Building, tmp_path: pathlib.Path
+) -> None:
+    filename = str(tmp_path / "presence.html")
+    reports.write_presence(simple_building, filename)
+    simple_building.add_person("Petr Novák")
+    simple_building.represent_flat("1", "Petr Novák")
+
+    with mock.patch.object(
+        reports_utils, "render_row", wraps=reports_utils.render_row
+    ) as render_row:
+        reports.write_presence(simple_building, filename)
+
+    assert render_row.call_count == 1
+    fresh = business.Building(simple_building.flats)
+    reports.write_presence(fresh, str(tmp_path / "fresh.html"))
+    content = (tmp_path / "presence.html").read_text()
+    assert content == (tmp_path / "fresh.html").read_text()
+    assert '<td class="unit">2</td>' in content
+    assert not (tmp_path / "presence.html.tmp").exists()
+
+
+def test_presence_pages(
+    simple_building: business.Building, tmp_path: pathlib.Path
+) -> None:
+    filename = tmp_path / "presence.html"
+    reports.write_presence(simple_building, str(filename), page_rows=2)
+
+    content = filename.read_text()
+    assert content.count("<table>") == 2
+    first_page, last_page = content.split("</table>")[:2]
+    assert '<td class="owner">Mezisoučet</td><td class="unit">1</td>' in first_page
+    assert '<td class="owner">Celkem</td><td class="unit">1</td>' in last_page
+
+
+def test_signatures_in_parallel(
+    simple_building: business.Building, tmp_path: pathlib.Path, monkeypatch: MonkeyPatch
+) -> None:
+    reports.write_signatures(simple_building, str(tmp_path / "serial.html"))
+    monkeypatch.setattr(presence, "PARALLEL_MIN_ROWS", 1)
+    monkeypatch.setattr(presence, "CHUNK_ROWS", 1)
+    parallel = business.Building(simple_building.flats)
+    reports.write_signatures(parallel, str(tmp_path / "parallel.html"), jobs=2)
+
+    content = (tmp_path / "serial.html").read_text()
+    assert content == (tmp_path / "parallel.html").read_text()
+    assert '<td class="owner">Celkem</td><td class="unit">3</td>' in content
+
+
+def test_signatures_small_building_in_process(
+    simple_building: business.Building, tmp_path: pathlib.Path, monkeypatch: MonkeyPatch
+) -> None:
+    monkeypatch.setattr(presence, "CHUNK_ROWS", 1)
+    monkeypatch.setattr(presence.futures, "ProcessPoolExecutor", None)
+
+    reports.write_signatures(simple_building, str(tmp_path / "out.html"), jobs=2)
+
+    content = (tmp_path / "out.html").read_text()
+    assert '<td class="owner">Celkem</td><td class="unit">3</td>' in content
+
+
+def test_collation_index(simple_building: business.Building) -> None:
+    with mock.patch("locale.strxfrm", side_effect=lambda name: name) as strxfrm:
+        index = reports_utils.CollationIndex(simple_building)
+        assert strxfrm.call_count == 3
+        names = index.sorted(["Petr Novák", "Jana Nová", "Oldřich Starý"])
+        assert names == ["Jana Nová", "Oldřich Starý", "Petr Novák"]
+        assert strxfrm.call_count == 3
+
+        index.sorted(["Zdeněk Cizí", "Jana Nová"])
+        assert strxfrm.call_count == 4
+
+
+def test_stats_disabled(simple_building: business.Building) -> None:
+    out = io.StringIO()
+    cmd = __main__.AppCmd(simple_building, stdout=out)
+
+    cmd.onecmd("stats")
+
+    assert out.getvalue() == "Statistics are disabled, start with --stats.\n"
+
+
+def test_stats(simple_building: business.Building) -> None:
+    out = io.StringIO()
+    latency_stats = stats.LatencyStats()
+    simple_building.register_stats(latency_stats)
+    simple_building.register_logger(__main__.CommandLogger(io.StringIO()))
+    cmd = __main__.AppCmd(simple_building, stdout=out, latency_stats=latency_stats)
+
+    for line in ["remove 3", "flat 1", "nonsense"]:
+        cmd.postcmd(cmd.onecmd(cmd.precmd(line)), line)
+
+    result = latency_stats.as_dict()
+    assert set(result["command"]) == {"remove", "flat", "<unknown>"}
+    assert set(result["building"]) == {"remove_person"}
+    assert set(result["log"]) == {"remove_person"}
+
+
 @freezegun.freeze_time("2017-01-14")
 def test_default_log_name() -> None:
     assert __main__.CommandLogger.default_logname("flats.json") == "flats.20170114.log"
@@ -370,6 +580,104 @@ def test_create_logfile(tmp_path: pathlib.Path) -> None:
     assert content == "date,operation,*args\n"
 
 
+def _log_session(log_path: pathlib.Path, every: int) -> business.Building:
+    model = business.Building([create_flat("1"), create_flat("2"), create_flat("3")])
+    logfile = __main__.CommandLogger.create_logfile(log_path)
+    snapshots = __main__.Snapshots(f"{log_path}.snapshot", model, every)
+    model.register_logger(__main__.CommandLogger(logfile, snapshots))
+    model.add_person("Petr Novák")
+    model.represent_flat("1", "Petr Novák")
+    model.add_person("Jana Nová")
+    model.represent_flat("2", "Jana Nová")
+    model.remove_person("Petr Novák")
+    logfile.close()
+    return model
+
+
+@pytest.mark.parametrize("verify", [False, True])
+def test_recover_from_snapshot(tmp_path: pathlib.Path, verify: bool) -> None:
+    log_path = tmp_path / "flats.log"
+    original = _log_session(log_path, every=2)
+    model = business.Building([create_flat("1"), create_flat("2"), create_flat("3")])
+
+    with open(log_path, "r+") as logfile:
+        __main__.open_or_create_logfile(logfile, model, "unused", verify)
+
+    assert model.dump_state()["flats"] == {"2": "Jana Nová"}
+    assert model.dump_state() == original.dump_state()
+    model.check_consistency()
+
+
+def test_recover_replays_only_tail(tmp_path: pathlib.Path) -> None:
+    log_path = tmp_path / "flats.log"
+    _log_session(log_path, every=4)
+    snapshot_path = tmp_path / "flats.log.snapshot"
+    snapshot = __main__.Snapshots.load(snapshot_path)
+    assert snapshot is not None
+    snapshot.state["flats"]["3"] = "Jana Nová"
+    __main__.Snapshots(snapshot_path, business.Building([])).save(snapshot)
+    model = business.Building([create_flat("1"), create_flat("2"), create_flat("3")])
+
+    with open(log_path, "r+") as logfile:
+        __main__.open_or_create_logfile(logfile, model, "unused")
+
+    assert model.dump_state()["flats"] == {"2": "Jana Nová", "3": "Jana Nová"}
+
+
+def test_recover_verify_detects_bad_snapshot(tmp_path: pathlib.Path) -> None:
+    log_path = tmp_path / "flats.log"
+    _log_session(log_path, every=4)
+    snapshot_path = tmp_path / "flats.log.snapshot"
+    snapshot = __main__.Snapshots.load(snapshot_path)
+    assert snapshot is not None
+    snapshot.state["flats"]["3"] = "Jana Nová"
+    __main__.Snapshots(snapshot_path, business.Building([])).save(snapshot)
+    model = business.Building([create_flat("1"), create_flat("2"), create_flat("3")])
+
+    with open(log_path, "r+") as logfile:
+        with pytest.warns(UserWarning, match="full replay"):
+            __main__.open_or_create_logfile(logfile, model, "unused", True)
+
+    assert model.dump_state()["flats"] == {"2": "Jana Nová"}
+
+
+def test_recover_ignores_stale_snapshot(tmp_path: pathlib.Path) -> None:
+    log_path = tmp_path / "flats.log"
+    _log_session(log_path, every=2)
+    __main__.CommandLogger.create_logfile(log_path).close()
+    model = business.Building([create_flat("1")])
+
+    with open(log_path, "r+") as logfile:
+        __main__.open_or_create_logfile(logfile, model, "unused")
+
+    assert model.dump_state() == {"persons": {}, "flats": {}}
+
+
+def test_recover_ignores_snapshot_of_another_log(tmp_path: pathlib.Path) -> None:
+    log_path = tmp_path / "flats.log"
+    _log_session(log_path, every=2)
+    snapshot_path = tmp_path / "flats.log.snapshot"
+    stale = snapshot_path.read_text()
+    # A new log with rows of the same length, the old snapshot is put back.
+    model = business.Building([create_flat("1"), create_flat("2"), create_flat("3")])
+    logfile = __main__.CommandLogger.create_logfile(log_path)
+    assert not snapshot_path.exists()
+    model.register_logger(__main__.CommandLogger(logfile))
+    model.add_person("Petr Kovák")
+    model.represent_flat("2", "Petr Kovák")
+    model.add_person("Jana Nová")
+    model.represent_flat("1", "Jana Nová")
+    model.remove_person("Petr Kovák")
+    logfile.close()
+    snapshot_path.write_text(stale)
+    model = business.Building([create_flat("1"), create_flat("2"), create_flat("3")])
+
+    with open(log_path, "r+") as logfile:
+        __main__.open_or_create_logfile(logfile, model, "unused")
+
+    assert model.dump_state()["flats"] == {"1": "Jana Nová"}
+
+
 @business.log_command
 def fake_operation(model: business.Building, a: str, b: str) -> int:
     del model  # Unused
@@ -380,6 +688,7 @@ def fake_operation(model: business.Building, a: str, b: str) -> int:
 
 def test_log_command_decorator() -> None:
     model = mock.Mock()
+    model._listeners = []
 
     result = fake_operation(model, "operand1", "operand2")
 
@@ -399,5 +708,66 @@ def test_logger_log() -> None:
     assert fout.getvalue() == "10:22,operation,a,b\r\n"
 
 
+@freezegun.freeze_time("2017-01-14T10:22")
+def test_durable_logger_log() -> None:
+    fout = io.StringIO()
+    logger = __main__.DurableCommandLogger(fout, fsync_interval=60)
+
+    logger.log("operation", ("a", "b"))
+    logger.flush()
+    logger.log("operation", ("c",))
+    logger.close()
+
+    assert fout.getvalue() == "10:22,operation,a,b\r\n10:22,operation,c\r\n"
+
+
+class BlockedFailingStream(io.StringIO):
+    def __init__(self) -> None:
+        super().__init__()
+        self.release = threading.Event()
+
+    def write(self, text: str) -> int:
+        self.release.wait()
+        raise OSError("disk full")
+
+
+def test_durable_logger_write_error() -> None:
+    stream = BlockedFailingStream()
+    logger = __main__.DurableCommandLogger(stream, fsync_interval=60)
+    logger.log("operation", ("a",))
+    logger.log("operation", ("b",))
+    done = threading.Event()
+    # The flush waits in the same batch as a row which fails to be written.
+    logger._queue.put(("flush", done))
+    stream.release.set()
+
+    assert done.wait(timeout=5)
+    with pytest.raises(IOError):
+        logger.flush()
+    with pytest.raises(IOError):
+        logger.close()
+
+
+def test_durable_logger_snapshots(tmp_path: pathlib.Path) -> None:
+    log_path = tmp_path / "flats.log"
+    model = business.Building([create_flat("1"), create_flat("2")])
+    logfile = __main__.CommandLogger.create_logfile(log_path)
+    snapshots = __main__.Snapshots(tmp_path / "flats.snapshot", model, every=2)
+    logger = __main__.DurableCommandLogger(logfile, snapshots, fsync_rows=1)
+    model.register_logger(logger)
+
+    model.add_person("Petr Novák")
+    model.represent_flat("1", "Petr Novák")
+    model.represent_flat("2", "Petr Novák")
+    logger.close()
+
+    snapshot = __main__.Snapshots.load(tmp_path / "flats.snapshot")
+    assert snapshot is not None
+    assert snapshot.state["flats"] == {"1": "Petr Novák"}
+    with open(log_path) as fin:
+        fin.seek(snapshot.offset)
+        assert fin.read().endswith(",represent_flat,2,Petr Novák\n")
+
+
 if __name__ == "__main__":
     pytest.main()
@@ -1,5 +1,8 @@
+import io
 import json
+import pathlib
 import pytest
+from _pytest.monkeypatch import MonkeyPatch
 from shromazdeni.tools import split
 
 
@@ -55,3 +58,16 @@ def test_invalid_flat(tmp_path):
                 str(tmp_path / "output.json"),
             ]
         )
+
+
+def test_split_json_lines_from_stdin(
+    tmp_path: pathlib.Path, monkeypatch: MonkeyPatch
+) -> None:
+    lines = "".join(json.dumps(flat) + "\n" for flat in FLATS)
+    monkeypatch.setattr("sys.stdin", io.StringIO(lines))
+
+    split.main(["-f=2", "-", "-o", str(tmp_path / "output.json")])
+
+    with open(tmp_path / "output.json") as output_file:
+        output = json.load(output_file)
+        assert [flat["name"] for flat in output] == ["1", "2-01"]
@@ -0,0 +1,37 @@
+import pytest
+
+from shromazdeni import stats
+
+
+def test_histogram() -> None:
+    histogram = stats.Histogram()
+    for seconds in [0.00005, 0.002, 0.003, 2.0]:
+        histogram.add(seconds)
+
+    result = histogram.as_dict()
+
+    assert result["count"] == 4
+    assert result["max_s"] == 2.0
+    assert result["p50_s"] == 0.005
+    assert result["p95_s"] == 2.0
+    assert result["buckets"]["<=0.0001"] == 1
+    assert result["buckets"]["<=0.005"] == 2
+    assert result["slower"] == 1
+
+
+def test_latency_stats() -> None:
+    latency_stats = stats.LatencyStats()
+    latency_stats.record("command", "add", 0.01)
+    latency_stats.record("building", "represent_flat", 0.001)
+    latency_stats.record("command", "add", 0.03)
+
+    result = latency_stats.as_dict()
+
+    assert set(result) == {"command", "building"}
+    assert result["command"]["add"]["count"] == 2
+    assert result["command"]["add"]["mean_s"] == pytest.approx(0.02)
+    assert "represent_flat" in latency_stats.format()
+
+
+if __name__ == "__main__":
+    pytest.main()
@@ -1,6 +1,11 @@
 import fractions
+import io
+import json
+import pathlib
+from unittest import mock
 
 import pytest
+from _pytest.monkeypatch import MonkeyPatch
 
 from shromazdeni import business
 from shromazdeni import utils
@@ -19,6 +24,22 @@ def test_format_persons_sjm() -> None:
     ]
 
 
+def test_format_persons_memoized() -> None:
+    address = "SJM Novák Jan a Nováková Petra, Pařížská 32, Praha 1"
+    hits = utils.name_cache_stats()["shromazdeni.utils._split_persons"]["hits"]
+
+    persons = utils.format_persons(address)
+    persons.append("modified")
+
+    assert utils.format_persons(address) == [
+        "Novák Jan, Pařížská 32, Praha 1",
+        "Nováková Petra, Pařížská 32, Praha 1",
+    ]
+    stats = utils.name_cache_stats()["shromazdeni.utils._split_persons"]
+    assert stats["hits"] >= hits + 1
+    assert 0 < stats["hit_rate"] <= 1
+
+
 def test_load_json() -> None:
     json_flats = [
         {"name": "1", "fraction": "1/3", "owners": [{"name": "P1", "fraction": "1"}]},
@@ -69,5 +90,118 @@ def test_load_json_shorten_names() -> None:
     ]
 
 
+def test_load_json_compact_flats() -> None:
+    json_flats = [
+        {"name": "1-1", "fraction": "1/3", "owners": [{"name": "P1", "fraction": "1"}]},
+        {"name": "2-1", "fraction": "2/3", "owners": [{"name": "P1", "fraction": "1"}]},
+    ]
+
+    flat1, flat2 = utils.from_json_to_flats(json_flats)
+
+    assert not hasattr(flat1, "__dict__")
+    assert flat1.owners[0].name is flat2.owners[0].name
+    assert flat1.owners[0].fraction is flat2.owners[0].fraction
+    assert flat1.sort_key == (1, 1)
+
+
+JSON_FLATS = [
+    {"name": "100/2", "fraction": "2/3", "owners": [{"name": "P2", "fraction": "1"}]},
+    {"name": "100/1", "fraction": "1/3", "owners": [{"name": "P1", "fraction": "1"}]},
+]
+
+
+def test_load_flats_uses_cache(tmp_path: pathlib.Path) -> None:
+    path = tmp_path / "flats.json"
+    path.write_text(json.dumps(JSON_FLATS))
+    with open(path, "rb") as fin:
+        expected = utils.load_flats(fin)
+    assert (tmp_path / "flats.json.cache").exists()
+
+    with mock.patch.object(utils, "from_json_to_flats") as convert:
+        with open(path, "rb") as fin:
+            flats = utils.load_flats(fin)
+
+    convert.assert_not_called()
+    assert flats == expected
+    assert [flat.name for flat in flats] == ["1", "2"]
+    # Shared with other buildings loaded into the same process.
+    assert flats[0].owners[0].name is expected[0].owners[0].name
+
+
+def test_load_flats_invalidates_cache(tmp_path: pathlib.Path) -> None:
+    path = tmp_path / "flats.json"
+    path.write_text(json.dumps(JSON_FLATS))
+    with open(path, "rb") as fin:
+        utils.load_flats(fin)
+    path.write_text(json.dumps(JSON_FLATS[:1]))
+
+    with open(path, "rb") as fin:
+        flats = utils.load_flats(fin)
+
+    assert [flat.name for flat in flats] == ["2"]
+
+
+def test_load_flats_without_cache(tmp_path: pathlib.Path) -> None:
+    path = tmp_path / "flats.json"
+    path.write_text(json.dumps(JSON_FLATS))
+
+    with open(path, "rb") as fin:
+        utils.load_flats(fin, use_cache=False)
+
+    assert not (tmp_path / "flats.json.cache").exists()
+
+
+@pytest.mark.parametrize("chunk_size", [1, 7, 64 * 1024])
+@pytest.mark.parametrize(
+    "content",
+    [
+        json.dumps(JSON_FLATS, ensure_ascii=False, indent=2),
+        "".join(json.dumps(flat, ensure_ascii=False) + "\n" for flat in JSON_FLATS),
+    ],
+)
+def test_iter_json_flats(
+    monkeypatch: MonkeyPatch, chunk_size: int, content: str
+) -> None:
+    monkeypatch.setattr(utils, "READ_CHUNK_SIZE", chunk_size)
+
+    assert list(utils.iter_json_flats(io.StringIO(content))) == JSON_FLATS
+    assert list(utils.iter_json_flats(io.BytesIO(content.encode()))) == JSON_FLATS
+
+
+@pytest.mark.parametrize("content", ["", " [ ] ", "\n"])
+def test_iter_json_flats_empty(content: str) -> None:
+    assert list(utils.iter_json_flats(io.StringIO(content))) == []
+
+
+def test_iter_json_flats_invalid() -> None:
+    with pytest.raises(json.JSONDecodeError):
+        list(utils.iter_json_flats(io.StringIO('[{"name": }]')))
+
+
+@pytest.mark.parametrize("chunk_size", [1, 64 * 1024])
+def test_iter_json_lines_truncated(monkeypatch: MonkeyPatch, chunk_size: int) -> None:
+    monkeypatch.setattr(utils, "READ_CHUNK_SIZE", chunk_size)
+    lines = [json.dumps(flat) + "\n" for flat in JSON_FLATS]
+
+    # A unit cut by an interrupted crawl must not disappear silently.
+    with pytest.raises(json.JSONDecodeError):
+        list(utils.iter_json_flats(io.StringIO(lines[0] + lines[1][:20])))
+    with pytest.raises(json.JSONDecodeError):
+        list(utils.iter_json_flats(io.StringIO(lines[0] + lines[1][:20] + "\n")))
+    with pytest.raises(json.JSONDecodeError):
+        list(utils.iter_json_flats(io.StringIO(lines[1][:20] + "\n" + lines[0])))
+
+
+def test_load_json_from_stream() -> None:
+    content = io.StringIO(json.dumps(JSON_FLATS))
+
+    flats = utils.from_json_to_flats(utils.iter_json_flats(content))
+
+    assert [(flat.name, flat.original_name) for flat in flats] == [
+        ("1", "100/1"),
+        ("2", "100/2"),
+    ]
+
+
 if __name__ == "__main__":
     pytest.main()